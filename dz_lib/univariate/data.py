@@ -1,6 +1,9 @@
+import hashlib
 import numpy as np
 
 class Grain:
+    __slots__ = ('age', 'uncertainty')
+
     def __init__(self, age: float, uncertainty: float):
         self.age = age
         self.uncertainty = uncertainty
@@ -11,55 +14,124 @@ class Grain:
             'uncertainty': self.uncertainty
         }
 
+class GrainView:
+    """
+    A grain of a Sample, read from and written through to the sample's
+    age and uncertainty arrays. A view is bound to its position, so views
+    are invalidated when grains are added to or removed from the sample (or
+    `grains` is reassigned); copy to a Grain to keep the values.
+    """
+    __slots__ = ('_sample', '_index')
+
+    def __init__(self, sample, index: int):
+        self._sample = sample
+        self._index = index
+
+    @property
+    def age(self):
+        return float(self._sample.ages[self._index])
+
+    @age.setter
+    def age(self, age: float):
+        self._sample.ages[self._index] = age
+
+    @property
+    def uncertainty(self):
+        return float(self._sample.uncertainties[self._index])
+
+    @uncertainty.setter
+    def uncertainty(self, uncertainty: float):
+        self._sample.uncertainties[self._index] = uncertainty
+
+    def to_dict(self):
+        return {
+            'age': self.age,
+            'uncertainty': self.uncertainty
+        }
+
 class Sample:
-    def __init__(self, name: str, grains: [Grain]):
+    """
+    A named detrital sample, stored column-wise as contiguous float arrays of
+    grain ages and uncertainties. `grains` gives per-grain access through
+    GrainView objects; it is a tuple, so add or remove grains with
+    add_grains / remove_grains (or assign a new list to `grains`).
+    """
+    def __init__(self, name: str, grains: [Grain] = None, ages=None, uncertainties=None):
         self.name = name
-        self.grains = grains
+        if grains is not None:
+            self.grains = grains
+        else:
+            self.ages = np.array([] if ages is None else ages, dtype=float)
+            self.uncertainties = np.array([] if uncertainties is None else uncertainties, dtype=float)
+            if self.ages.shape != self.uncertainties.shape:
+                raise ValueError("Ages and uncertainties must have the same length.")
+
+    @classmethod
+    def from_arrays(cls, name: str, ages, uncertainties):
+        return cls(name, ages=ages, uncertainties=uncertainties)
+
+    @property
+    def grains(self):
+        return tuple(GrainView(self, i) for i in range(len(self.ages)))
+
+    @grains.setter
+    def grains(self, grains: [Grain]):
+        self.ages = np.array([grain.age for grain in grains], dtype=float)
+        self.uncertainties = np.array([grain.uncertainty for grain in grains], dtype=float)
+
+    def __len__(self):
+        return len(self.ages)
+
+    def add_grains(self, grains: [Grain]):
+        self.ages = np.concatenate([self.ages, [grain.age for grain in grains]])
+        self.uncertainties = np.concatenate([self.uncertainties, [grain.uncertainty for grain in grains]])
+        return self
+
+    def remove_grains(self, indices: [int]):
+        self.ages = np.delete(self.ages, indices)
+        self.uncertainties = np.delete(self.uncertainties, indices)
+        return self
 
     def replace_grain_uncertainties(self, bandwidth: float):
-        for grain in self.grains:
-            grain.uncertainty = bandwidth
+        self.uncertainties[:] = bandwidth
         return self
 
     def get_q1_age(self):
-        ages = self.get_ages()
-        q1_age = np.quantile(ages, 0.25)
+        q1_age = np.quantile(self.ages, 0.25)
         return q1_age
 
     def get_median_age(self):
-        ages = self.get_ages()
-        median_age = np.quantile(ages, 0.5)
+        median_age = np.quantile(self.ages, 0.5)
         return median_age
 
     def get_q3_age(self):
-        ages = self.get_ages()
-        q3_age = np.quantile(ages, 0.75)
+        q3_age = np.quantile(self.ages, 0.75)
         return q3_age
 
+    def content_hash(self):
+        digest = hashlib.sha1(np.ascontiguousarray(self.ages).tobytes())
+        digest.update(np.ascontiguousarray(self.uncertainties).tobytes())
+        return digest.hexdigest()
+
     def get_ages(self):
-        grains = self.grains
-        ages = [grain.age for grain in grains]
-        return ages
+        return self.ages.tolist()
 
     def get_outlier_grains(self):
-        q1 = self.get_q1_age()
-        q3 = self.get_q3_age()
+        q1, q3 = np.quantile(self.ages, [0.25, 0.75])
         iqr = q3 - q1
-        outliers = []
-        for grain in self.grains:
-            if grain.age > q3 + 1.5 * iqr or grain.age < q1 - 1.5 * iqr:
-                outliers.append(grain)
-        return outliers
+        outliers = (self.ages > q3 + 1.5 * iqr) | (self.ages < q1 - 1.5 * iqr)
+        return [Grain(age, uncertainty) for age, uncertainty in
+                zip(self.ages[outliers].tolist(), self.uncertainties[outliers].tolist())]
 
     def to_dict(self):
         return {
             'name': self.name,
-            'grains': [grain.to_dict() for grain in self.grains]
+            'grains': [
+                {'age': age, 'uncertainty': uncertainty}
+                for age, uncertainty in zip(self.ages.tolist(), self.uncertainties.tolist())
+            ]
         }
     def subset(self, min_age: float, max_age: float, uncertainty_coefficient: float=0):
-        subset_grains = []
-        for grain in self.grains:
-            if grain.age - (grain.uncertainty * uncertainty_coefficient) >= min_age:
-                if grain.age + (grain.uncertainty * uncertainty_coefficient) <= max_age:
-                    subset_grains.append(grain)
-        return Sample(self.name, subset_grains)
+        margins = self.uncertainties * uncertainty_coefficient
+        mask = (self.ages - margins >= min_age) & (self.ages + margins <= max_age)
+        return Sample.from_arrays(self.name, self.ages[mask], self.uncertainties[mask])
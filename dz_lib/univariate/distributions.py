@@ -1,20 +1,211 @@
-from dz_lib.univariate.data import Sample
+from dz_lib.univariate.data import Grain, Sample
+from dz_lib.univariate.grid import GridSpec, default_grid
 from dz_lib.utils import fonts, encode
+from dz_lib.utils.cache import DistributionCache
+from collections import OrderedDict
+import warnings
 import numpy as np
+import scipy.fft as sp_fft
+import scipy.signal as sp_signal
+from scipy.optimize import brentq
+from scipy.special import ndtr
 import matplotlib.pyplot as plt
 import matplotlib.gridspec as gridspec
 
 
 class Distribution:
-    def __init__(self, name, x_values, y_values):
+    def __init__(self, name, x_values, y_values, grid: GridSpec = None):
         self.name = name
         self.x_values = x_values
         self.y_values = y_values
+        self.grid = grid
 
-    def subset(self, x_min: float, x_max: float):
+    def subset(self, x_min: float, x_max: float, sparse: bool = False):
         mask = (self.x_values > x_min) & (self.x_values < x_max)
+        if sparse:
+            indices = np.flatnonzero(mask)
+            start = indices[0] if len(indices) else 0
+            stop = indices[-1] + 1 if len(indices) else 0
+            return SparseDistribution(self.name, self.x_values, start, self.y_values[start:stop], grid=self.grid)
         new_y_vals = np.where(mask, self.y_values, 0)
-        return Distribution(self.name, self.x_values, new_y_vals)
+        return Distribution(self.name, self.x_values, new_y_vals, grid=self.grid)
+
+    def trim(self, threshold: float = 1e-12):
+        """
+        SparseDistribution over the support of this distribution: the span
+        from the first to the last y value above threshold * max(y). The
+        default threshold drops only round-off noise (e.g. from FFT-built
+        curves). The values are a view of this distribution's y values, not
+        a copy.
+        """
+        indices = np.flatnonzero(self.y_values > threshold * np.max(self.y_values))
+        start = indices[0] if len(indices) else 0
+        stop = indices[-1] + 1 if len(indices) else 0
+        return SparseDistribution(self.name, self.x_values, start, self.y_values[start:stop], grid=self.grid)
+
+
+class SparseDistribution:
+    """
+    A distribution stored only over its support: `values` holds the y values
+    from grid index `offset` onwards and the y values everywhere else on the
+    grid are zero. x_values is the full (shared) grid.
+    """
+
+    def __init__(self, name, x_values, offset: int, values, grid: GridSpec = None):
+        self.name = name
+        self.x_values = x_values
+        self.offset = int(offset)
+        self.values = values
+        self.grid = grid
+
+    @property
+    def stop(self):
+        return self.offset + len(self.values)
+
+    @property
+    def support(self):
+        if len(self.values) == 0:
+            return None
+        return self.x_values[self.offset], self.x_values[self.stop - 1]
+
+    @property
+    def y_values(self):
+        y_values = np.zeros(len(self.x_values))
+        y_values[self.offset:self.stop] = self.values
+        return y_values
+
+    def to_dense(self):
+        return Distribution(self.name, self.x_values, self.y_values, grid=self.grid)
+
+
+def check_grids(distributions: [Distribution]):
+    """
+    Raise ValueError unless all distributions are on the same grid, comparing
+    their GridSpecs where both have one and their x values otherwise.
+    Returns the shared GridSpec, if any.
+    """
+    first = distributions[0]
+    grid = first.grid
+    for dist in distributions[1:]:
+        if grid is not None and dist.grid is not None:
+            grid.check_compatible(dist.grid)
+        elif not np.array_equal(first.x_values, dist.x_values):
+            raise ValueError(f"'{first.name}' and '{dist.name}' are not on the same grid.")
+        grid = grid if grid is not None else dist.grid
+    return grid
+
+
+def _resolve_grid(grid: GridSpec, x_min: float, x_max: float):
+    return grid if grid is not None else default_grid(x_min, x_max)
+
+
+class IncrementalDistribution(Distribution):
+    """
+    A KDE or PDP that can be updated as grains are added to or removed from
+    its sample. It keeps the unnormalised sum of grain kernels; adding or
+    removing grains adds or subtracts only their own truncated kernels, which
+    touches the grid points within +/- n_sigma of each grain. y_values is
+    normalised lazily when read; once every grain has been removed (or the
+    remaining sum is no more than rounding residue) it is all zeros.
+
+    Removing a grain that was never added is not detected and leaves a
+    negative kernel in the sum.
+    """
+
+    def __init__(
+        self,
+        sample: Sample,
+        function_type: str = "kde",
+        bandwidth: float = 10,
+        x_min: float = 0,
+        x_max: float = 4500,
+        n_sigma: float = 8,
+        grid: GridSpec = None,
+    ):
+        if function_type not in ("kde", "pdp"):
+            raise ValueError(f"Unknown function type '{function_type}'")
+        grid = _resolve_grid(grid, x_min, x_max)
+        super().__init__(sample.name, grid.x_values, np.zeros(grid.n_steps), grid=grid)
+        self.function_type = function_type
+        self.bandwidth = bandwidth
+        self.n_sigma = n_sigma
+        self.n_grains = 0
+        self._n_updated = 0
+        self._update(sample.ages, sample.uncertainties, 1.0)
+
+    @property
+    def y_values(self):
+        if self._y_values is None:
+            y_values = np.maximum(self.kernel_sum, 0)
+            total = np.sum(y_values)
+            # each kernel contributes about 1 / step to the sum; adding and removing
+            # kernels leaves cancellation residue on the order of 1e-16 of that
+            residue = 1e-9 * self._n_updated / self.grid.step
+            if self.n_grains <= 0 or total <= residue:
+                self._y_values = np.zeros_like(y_values)
+            else:
+                self._y_values = y_values / total
+        return self._y_values
+
+    @y_values.setter
+    def y_values(self, y_values):
+        self.kernel_sum = np.array(y_values, dtype=float)
+        self._y_values = None
+
+    def add_grains(self, grains: [Grain]):
+        ages = np.array([grain.age for grain in grains], dtype=float)
+        uncertainties = np.array([grain.uncertainty for grain in grains], dtype=float)
+        self._update(ages, uncertainties, 1.0)
+        return self
+
+    def remove_grains(self, grains: [Grain]):
+        ages = np.array([grain.age for grain in grains], dtype=float)
+        uncertainties = np.array([grain.uncertainty for grain in grains], dtype=float)
+        self._update(ages, uncertainties, -1.0)
+        return self
+
+    def _update(self, ages, uncertainties, scale):
+        if self.function_type == "kde":
+            bandwidths = np.full(len(ages), self.bandwidth, dtype=float)
+        else:
+            bandwidths = uncertainties
+        _truncated_kernel_sum(self.x_values, ages, bandwidths, self.n_sigma, out=self.kernel_sum, scale=scale)
+        self.n_grains += int(scale) * len(ages)
+        self._n_updated += len(ages)
+        self._y_values = None
+
+
+class DistributionSet:
+    """
+    Distributions of several samples on one shared x grid, stored as a
+    contiguous (n_samples, G) matrix of y values.
+    """
+
+    def __init__(self, names: [str], x_values: np.ndarray, y_values: np.ndarray, grid: GridSpec = None):
+        self.names = list(names)
+        self.x_values = x_values
+        self.y_values = y_values
+        self.grid = grid
+
+    def __len__(self):
+        return len(self.names)
+
+    def __getitem__(self, index: int):
+        return Distribution(self.names[index], self.x_values, self.y_values[index], grid=self.grid)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def to_distributions(self):
+        return list(self)
+
+    @classmethod
+    def from_distributions(cls, distributions: [Distribution]):
+        grid = check_grids(distributions)
+        names = [dist.name for dist in distributions]
+        y_values = np.vstack([dist.y_values for dist in distributions])
+        return cls(names, distributions[0].x_values, y_values, grid=grid)
 
 
 # ----------------------------------------------------------------------
@@ -27,115 +218,734 @@ def find_peaks(x: np.ndarray, y: np.ndarray, n_peaks: int):
     """
     if n_peaks <= 0:
         return []
+    return find_modes_batch(x, np.asarray(y)[np.newaxis, :], n_peaks)[0]
 
-    peaks = []
 
-    max_idx = np.argmax(y)
-    peaks.append((x[max_idx], y[max_idx]))
+def find_modes(x: np.ndarray, y: np.ndarray, n_modes: int):
+    """
+    Robust mode finder for smooth KDE/PDP curves.
+    Always includes the global maximum.
+    """
+    return find_modes_batch(x, np.asarray(y)[np.newaxis, :], max(n_modes, 1))[0]
 
-    if n_peaks == 1:
-        return peaks
 
-    dy = np.diff(y)
-    signs = np.sign(dy)
+def find_modes_batch(
+    x: np.ndarray,
+    y: np.ndarray,
+    n_modes: int,
+    prominence: float = None,
+    min_separation: float = None,
+):
+    """
+    Up to n_modes modes of each row of an (n, G) matrix of curves on the
+    grid x, as one list of (x, y) tuples per row, highest first. The global
+    maximum of each row always comes first. Local maxima are found with one
+    diff/sign pass over the whole matrix and the top n per row are selected
+    with a partition rather than a full sort; ties go to the lower x.
+
+    Optional filters: prominence drops local maxima whose topographic
+    prominence (scipy.signal.peak_prominences) is below the given y value;
+    min_separation greedily drops modes closer than that distance in x to a
+    higher mode already kept.
+    """
+    y = np.atleast_2d(np.asarray(y, dtype=float))
+    n_rows, n_points = y.shape
+    if n_modes <= 0 or n_points == 0:
+        return [[] for _ in range(n_rows)]
+
+    signs = np.sign(np.diff(y, axis=1))
+    is_candidate = np.zeros((n_rows, n_points), dtype=bool)
+    is_candidate[:, 1:-1] = (signs[:, :-1] >= 0) & (signs[:, 1:] <= 0)
+    if prominence is not None:
+        for row in range(n_rows):
+            candidates = np.flatnonzero(is_candidate[row])
+            with warnings.catch_warnings():
+                # flat stretches are candidates too and legitimately have zero prominence
+                warnings.simplefilter("ignore")
+                prominences = sp_signal.peak_prominences(y[row], candidates)[0]
+            is_candidate[row, candidates[prominences < prominence]] = False
+    scores = np.where(is_candidate, y, -np.inf)
+    scores[np.arange(n_rows), np.argmax(y, axis=1)] = np.inf
+
+    n_keep = n_points if min_separation is not None else min(n_modes, n_points)
+    kth = -np.partition(-scores, n_keep - 1, axis=1)[:, n_keep - 1:n_keep]
+    above = scores > kth
+    tied = scores == kth
+    n_tied_needed = n_keep - above.sum(axis=1, keepdims=True)
+    selected = above | (tied & (np.cumsum(tied, axis=1) <= n_tied_needed))
+    selected &= scores > -np.inf
+    indices = np.broadcast_to(np.arange(n_points), scores.shape)
+    order = np.lexsort((indices, np.where(selected, -scores, np.inf)), axis=1)
+
+    modes = []
+    for row in range(n_rows):
+        row_indices = order[row, :selected[row].sum()]
+        kept = []
+        for i in row_indices:
+            if min_separation is not None and any(abs(x[i] - x[j]) < min_separation for j in kept):
+                continue
+            kept.append(i)
+            if len(kept) >= n_modes:
+                break
+        modes.append([(x[i], y[row, i]) for i in kept])
+    return modes
 
-    candidates = np.where(
-        (signs[:-1] >= 0) & (signs[1:] <= 0)
-    )[0] + 1
 
-    candidates = [i for i in candidates if i != max_idx]
-    candidates = sorted(candidates, key=lambda i: y[i], reverse=True)
+# ----------------------------------------------------------------------
+# Kernel evaluation engines
+# ----------------------------------------------------------------------
+def _dense_kernel_sum(
+    x_values: np.ndarray,
+    ages: np.ndarray,
+    bandwidths: np.ndarray,
+    chunk_size: int = None,
+    max_memory: int = None,
+    out: np.ndarray = None,
+):
+    """
+    Sum of Gaussian kernels with per-grain bandwidths, evaluated at every grid
+    point. Grains are processed in blocks of `chunk_size` rows (or as many
+    rows as fit in `max_memory` bytes) and each block's kernels are built in a
+    single scratch array and accumulated into `out`, so peak memory is one
+    block x G array rather than several N x G temporaries.
+    """
+    if out is None:
+        out = np.zeros(len(x_values))
+    n_grains = len(ages)
+    if chunk_size is None:
+        if max_memory is not None:
+            chunk_size = max_memory // (len(x_values) * np.dtype(float).itemsize)
+        else:
+            chunk_size = n_grains
+    chunk_size = max(int(chunk_size), 1)
+
+    for start in range(0, n_grains, chunk_size):
+        block_ages = ages[start:start + chunk_size, np.newaxis]
+        block_bandwidths = bandwidths[start:start + chunk_size, np.newaxis]
+        kernels = x_values[np.newaxis, :] - block_ages
+        np.square(kernels, out=kernels)
+        kernels /= -2 * block_bandwidths ** 2
+        np.exp(kernels, out=kernels)
+        kernels *= 1.0 / (np.sqrt(2 * np.pi) * block_bandwidths)
+        out += kernels.sum(axis=0)
+    return out
+
+
+def _linear_bin(x_values: np.ndarray, ages: np.ndarray, pad: int, groups: np.ndarray = None, n_groups: int = 1):
+    """
+    Spread each age over its two neighbouring grid points (linear binning)
+    on the grid extended by `pad` points at each end. Ages beyond the
+    extended grid are dropped. If `groups` gives a row index per age, the
+    result is an (n_groups, n_bins) matrix with one row per group.
+    """
+    step = x_values[1] - x_values[0]
+    n_bins = len(x_values) + 2 * pad
+    positions = (ages - x_values[0]) / step + pad
+    inside = (positions >= 0) & (positions <= n_bins - 1)
+    positions = positions[inside]
+    lower = np.minimum(np.floor(positions).astype(int), n_bins - 2)
+    frac = positions - lower
+    if groups is not None:
+        lower = lower + groups[inside] * n_bins
+    size = n_groups * n_bins
+    counts = np.bincount(lower, weights=1 - frac, minlength=size)
+    counts += np.bincount(lower + 1, weights=frac, minlength=size)
+    if groups is not None:
+        return counts.reshape(n_groups, n_bins)
+    return counts
+
+
+def _binned_kernel_sum(
+    x_values: np.ndarray,
+    ages: np.ndarray,
+    bandwidth: float,
+    n_sigma: float = 8,
+    groups: np.ndarray = None,
+    n_groups: int = 1,
+):
+    """
+    Sum of Gaussian kernels centred on `ages`, evaluated on the evenly spaced
+    `x_values` by linear binning followed by an FFT convolution. Kernels are
+    truncated at +/- n_sigma bandwidths. With `groups`, one curve per group is
+    returned as the rows of a matrix, all convolved in one batched FFT.
+    """
+    step = x_values[1] - x_values[0]
+    half_width = max(int(np.ceil(n_sigma * bandwidth / step)), 1)
+    counts = _linear_bin(x_values, ages, half_width, groups, n_groups)
+
+    offsets = np.arange(-half_width, half_width + 1) * step
+    kernel = np.exp(-offsets ** 2 / (2 * bandwidth ** 2)) / (np.sqrt(2 * np.pi) * bandwidth)
+
+    n_fft = sp_fft.next_fast_len(counts.shape[-1] + len(kernel) - 1, real=True)
+    convolved = sp_fft.irfft(
+        sp_fft.rfft(counts, n_fft, axis=-1) * sp_fft.rfft(kernel, n_fft), n_fft, axis=-1
+    )
+    # Full convolution index k corresponds to extended-grid index k - half_width,
+    # and the requested grid starts half_width points into the extended grid.
+    start = 2 * half_width
+    y_values = convolved[..., start:start + len(x_values)]
+    return np.maximum(y_values, 0)
+
+
+def _truncated_cdf_sum(
+    x_values: np.ndarray,
+    ages: np.ndarray,
+    bandwidths: np.ndarray,
+    n_sigma: float = 8,
+    out: np.ndarray = None,
+    groups: np.ndarray = None,
+    n_groups: int = 1,
+    max_elements: int = 2 ** 16,
+):
+    """
+    Sum of per-grain normal CDFs on the grid. Each CDF is evaluated with ndtr
+    only within +/- n_sigma of its grain; beyond the window it is exactly 1,
+    added for all such grains at once from a cumulative count of window ends.
+
+    The windows are evaluated together as padded (grains x window) blocks of
+    at most max_elements values, grains being grouped by window width so that
+    little of each block is padding, and each block is scattered into the span
+    of the output it covers with bincount. If `groups` gives a row index per grain, the result is an
+    (n_groups, G) matrix with one row per group.
+    """
+    n_points = len(x_values)
+    if out is None:
+        out = np.zeros((n_groups, n_points) if groups is not None else n_points)
+    if groups is None:
+        groups = np.zeros(len(ages), dtype=int)
+    flat_out = out.reshape(-1)
+    step = x_values[1] - x_values[0]
+    reach = n_sigma * bandwidths
+    starts = np.clip(np.ceil((ages - reach - x_values[0]) / step), 0, n_points).astype(int)
+    stops = np.clip(np.floor((ages + reach - x_values[0]) / step) + 1, 0, n_points).astype(int)
+
+    window_ends = np.bincount(groups * (n_points + 1) + stops, minlength=flat_out.size // n_points * (n_points + 1))
+    flat_out += np.cumsum(window_ends.reshape(-1, n_points + 1), axis=1)[:, :n_points].reshape(-1)
+
+    widths = stops - starts
+    # bucket grains into classes of similar window width, in output order within each class,
+    # so that blocks carry little padding and touch a narrow span of the output
+    classes = np.ceil(np.log(np.maximum(widths, 1)) / np.log(1.25)).astype(int)
+    first_cells = groups * n_points + starts
+    order = np.lexsort((first_cells, classes))
+    order = order[widths[order] > 0]
+    # work in grid units: z = (column - offset) * scale, padding cells get z = -inf so ndtr gives 0
+    offsets = (ages - x_values[0]) / step
+    scales = step / bandwidths
+    position = 0
+    while position < len(order):
+        block_class = classes[order[position]]
+        block = order[position:position + max(1, max_elements // widths[order[position]])]
+        block = block[classes[block] == block_class]
+        max_width = widths[block].max()
+        block = block[:max(1, max_elements // max_width)]
+        position += len(block)
+        window = np.arange(max_width)
+        z = (starts[block, np.newaxis] - offsets[block, np.newaxis]) + window
+        z *= scales[block, np.newaxis]
+        np.putmask(z, window >= widths[block, np.newaxis], -np.inf)
+        # padding cells may run past the output; they carry zeros and are cut off after the scatter
+        low = first_cells[block].min()
+        high = min(first_cells[block].max() + len(window), flat_out.size)
+        indices = (first_cells[block] - low)[:, np.newaxis] + window
+        flat_out[low:high] += np.bincount(indices.ravel(), weights=ndtr(z, out=z).ravel())[:high - low]
+    return out
+
+
+def _binned_variable_kernel_sum(
+    x_values: np.ndarray,
+    ages: np.ndarray,
+    bandwidths: np.ndarray,
+    class_ratio: float = 1.05,
+):
+    """
+    Binned evaluation of kernels with per-grain bandwidths: grains are grouped
+    into bandwidth classes whose widths differ by at most `class_ratio`, and
+    each class is convolved by FFT with its geometric-mean bandwidth.
+    """
+    classes = np.floor(np.log(bandwidths / bandwidths.min()) / np.log(class_ratio)).astype(int)
+    y_values = np.zeros(len(x_values))
+    for grain_class in np.unique(classes):
+        members = classes == grain_class
+        class_bandwidth = np.exp(np.mean(np.log(bandwidths[members])))
+        y_values += _binned_kernel_sum(x_values, ages[members], class_bandwidth)
+    return y_values
+
+
+def _truncated_kernel_sum(
+    x_values: np.ndarray,
+    ages: np.ndarray,
+    bandwidths: np.ndarray,
+    n_sigma: float = 8,
+    out: np.ndarray = None,
+    scale: float = 1.0,
+):
+    """
+    Sum of Gaussian kernels with per-grain bandwidths, each evaluated only on
+    the grid points within +/- n_sigma of its centre and added into `out`
+    after multiplying by `scale` (-1 subtracts the kernels).
+    """
+    if out is None:
+        out = np.zeros(len(x_values))
+    step = x_values[1] - x_values[0]
+    reach = n_sigma * bandwidths
+    starts = np.clip(np.ceil((ages - reach - x_values[0]) / step), 0, len(x_values)).astype(int)
+    stops = np.clip(np.floor((ages + reach - x_values[0]) / step) + 1, 0, len(x_values)).astype(int)
+    normalizations = scale / (np.sqrt(2 * np.pi) * bandwidths)
+    for age, bandwidth, normalization, start, stop in zip(ages, bandwidths, normalizations, starts, stops):
+        if start >= stop:
+            continue
+        window = x_values[start:stop]
+        out[start:stop] += normalization * np.exp(-(window - age) ** 2 / (2 * bandwidth ** 2))
+    return out
 
-    for i in candidates:
-        peaks.append((x[i], y[i]))
-        if len(peaks) >= n_peaks:
-            break
 
-    return peaks
+# ----------------------------------------------------------------------
+# Bandwidth selection
+# ----------------------------------------------------------------------
+_BANDWIDTH_CACHE_SIZE = 1024
+_bandwidth_cache = OrderedDict()
 
 
-def find_modes(x: np.ndarray, y: np.ndarray, n_modes: int):
+def select_bandwidth(sample: Sample, method: str = "isj"):
     """
-    Robust mode finder for smooth KDE/PDP curves.
-    Always includes the global maximum.
+    Data-driven KDE bandwidth for a sample, cached by the sample's content
+    so that repeated calls for the same ages cost nothing. The cache keeps
+    the most recently used _BANDWIDTH_CACHE_SIZE entries; see
+    clear_bandwidth_cache.
+
+    method="isj" (or "auto") is the improved Sheather-Jones estimator of
+    Botev et al. (2010), computed from a DCT of the binned ages.
+    method="lscv" minimises the least-squares cross-validation score over a
+    grid of candidate bandwidths.
     """
-    modes = [(x[np.argmax(y)], np.max(y))]
+    if method == "auto":
+        method = "isj"
+    key = (sample.content_hash(), method)
+    if key in _bandwidth_cache:
+        _bandwidth_cache.move_to_end(key)
+        return _bandwidth_cache[key]
+    if method == "isj":
+        bandwidth = isj_bandwidth(sample.ages)
+    elif method == "lscv":
+        bandwidth = lscv_bandwidth(sample.ages)
+    else:
+        raise ValueError(f"Unknown bandwidth method '{method}'")
+    _bandwidth_cache[key] = bandwidth
+    while len(_bandwidth_cache) > _BANDWIDTH_CACHE_SIZE:
+        _bandwidth_cache.popitem(last=False)
+    return bandwidth
 
-    if n_modes == 1:
-        return modes
 
-    dy = np.diff(y)
-    signs = np.sign(dy)
+def clear_bandwidth_cache():
+    """Forget every bandwidth cached by select_bandwidth."""
+    _bandwidth_cache.clear()
 
-    candidates = np.where(
-        (signs[:-1] >= 0) & (signs[1:] <= 0)
-    )[0] + 1
 
-    candidates = [i for i in candidates if i != np.argmax(y)]
-    candidates = sorted(candidates, key=lambda i: y[i], reverse=True)
+def _silverman_bandwidth(ages: np.ndarray):
+    iqr = np.subtract(*np.percentile(ages, [75, 25]))
+    spread = min(np.std(ages), iqr / 1.34) if iqr > 0 else np.std(ages)
+    return 0.9 * spread * len(ages) ** (-1 / 5)
 
-    for i in candidates:
-        modes.append((x[i], y[i]))
-        if len(modes) >= n_modes:
-            break
 
-    return modes
+def _isj_fixed_point(t, n, squared_indices, squared_coefficients):
+    # Botev et al. (2010), eq. 30 fixed point t = xi * gamma^[l](t), with l = 7 stages
+    stages = 7
+    functional = 2 * np.pi ** (2 * stages) * np.sum(
+        squared_indices ** stages * squared_coefficients * np.exp(-squared_indices * np.pi ** 2 * t)
+    )
+    for s in range(stages - 1, 1, -1):
+        k0 = np.prod(np.arange(1, 2 * s, 2)) / np.sqrt(2 * np.pi)
+        const = (1 + (1 / 2) ** (s + 1 / 2)) / 3
+        time = (2 * const * k0 / n / functional) ** (2 / (3 + 2 * s))
+        functional = 2 * np.pi ** (2 * s) * np.sum(
+            squared_indices ** s * squared_coefficients * np.exp(-squared_indices * np.pi ** 2 * time)
+        )
+    return t - (2 * n * np.sqrt(np.pi) * functional) ** (-2 / 5)
+
+
+def isj_bandwidth(ages, n_bins: int = 2 ** 14):
+    """
+    Improved Sheather-Jones bandwidth (Botev, Grotowski and Kroese, 2010).
+    The ages are binned onto n_bins points spanning the data range padded by
+    half of it on each side, and the density functionals are evaluated from
+    the DCT of the bin counts. Falls back to Silverman's rule when the fixed
+    point equation has no root (e.g. very few distinct ages).
+    """
+    ages = np.asarray(ages, dtype=float)
+    data_range = np.ptp(ages)
+    n_unique = len(np.unique(ages))
+    if n_unique < 2 or data_range == 0:
+        raise ValueError("At least two distinct ages are needed to select a bandwidth.")
+    lower = ages.min() - data_range / 2
+    upper = ages.max() + data_range / 2
+    span = upper - lower
+    counts, _ = np.histogram(ages, bins=n_bins, range=(lower, upper))
+    coefficients = sp_fft.dct(counts / len(ages), type=2)
+    squared_indices = np.arange(1, n_bins, dtype=float) ** 2
+    squared_coefficients = (coefficients[1:] / 2) ** 2
+
+    for upper_t in (0.1, 0.2, 0.4, 0.8):
+        try:
+            t_star = brentq(
+                _isj_fixed_point, 0, upper_t, args=(n_unique, squared_indices, squared_coefficients)
+            )
+            return float(np.sqrt(t_star) * span)
+        except ValueError:
+            continue
+    return float(_silverman_bandwidth(ages))
+
+
+def lscv_bandwidth(ages, candidates: np.ndarray = None, n_bins: int = 2 ** 12):
+    """
+    Least-squares cross-validation bandwidth for a Gaussian KDE. Pairwise age
+    differences are approximated on n_bins bins, with their counts per lag
+    taken from one FFT autocorrelation, so every candidate bandwidth is scored
+    in a single vectorized pass.
+    """
+    ages = np.asarray(ages, dtype=float)
+    n = len(ages)
+    data_range = np.ptp(ages)
+    if n < 2 or data_range == 0:
+        raise ValueError("At least two distinct ages are needed to select a bandwidth.")
+    bin_width = data_range / (n_bins - 1)
+    counts = np.bincount(np.round((ages - ages.min()) / bin_width).astype(int), minlength=n_bins).astype(float)
+    n_fft = sp_fft.next_fast_len(2 * n_bins, real=True)
+    spectrum = sp_fft.rfft(counts, n_fft)
+    pair_counts = sp_fft.irfft(spectrum * np.conj(spectrum), n_fft)[:n_bins]
+    pair_counts = np.round(pair_counts)
+    pair_counts[0] -= n  # drop each age paired with itself
+    pair_counts[1:] *= 2  # ordered pairs
+    lags = np.arange(n_bins) * bin_width
+
+    if candidates is None:
+        candidates = np.geomspace(max(bin_width, data_range / 1e4), data_range / 2, 200)
+    h = np.asarray(candidates, dtype=float)
+    squared_ratios = (lags[np.newaxis, :] / h[:, np.newaxis]) ** 2
+    # integral of the squared KDE, and the mean leave-one-out density at the ages
+    integral = (n + np.exp(-squared_ratios / 4) @ pair_counts) / (n ** 2 * 2 * h * np.sqrt(np.pi))
+    leave_one_out = (np.exp(-squared_ratios / 2) @ pair_counts) / (n * (n - 1) * h * np.sqrt(2 * np.pi))
+    scores = integral - 2 * leave_one_out
+    return float(h[np.argmin(scores)])
+
+
+def adaptive_bandwidths(x_values: np.ndarray, ages: np.ndarray, bandwidth: float, sensitivity: float = 0.5):
+    """
+    Per-grain bandwidths for an adaptive KDE (Abramson, 1982): a fixed
+    `bandwidth` pilot KDE f is evaluated at each age, and grain i gets
+    bandwidth * (f(age_i) / g) ** -sensitivity, where g is the geometric mean
+    of the pilot densities. Grains in dense peaks get narrower kernels and
+    grains in sparse tails wider ones. The pilot is an FFT-binned KDE read off
+    the grid, floored at each grain's own kernel peak.
+    """
+    ages = np.asarray(ages, dtype=float)
+    pilot = _binned_kernel_sum(x_values, ages, bandwidth) / len(ages)
+    floor = 1.0 / (len(ages) * np.sqrt(2 * np.pi) * bandwidth)
+    densities = np.maximum(np.interp(ages, x_values, pilot, left=0, right=0), floor)
+    geometric_mean = np.exp(np.mean(np.log(densities)))
+    return bandwidth * (densities / geometric_mean) ** -sensitivity
 
 
 # ----------------------------------------------------------------------
 # Distribution generators
 # ----------------------------------------------------------------------
+def _cache_key(sample: Sample, function_type: str, grid: GridSpec, method, parameter):
+    # parameter is the bandwidth for KDEs and the n_sigma truncation for PDPs
+    return DistributionCache.make_key(
+        sample.content_hash(), function_type, grid.x_min, grid.x_max, grid.step, grid.n_steps, method, float(parameter)
+    )
+
+
 def kde_function(
     sample: Sample,
     bandwidth: float = 10,
     x_min: float = 0,
     x_max: float = 4500,
+    method: str = "dense",
+    chunk_size: int = None,
+    max_memory: int = None,
+    cache: DistributionCache = None,
+    adaptive: bool = False,
+    sensitivity: float = 0.5,
+    grid: GridSpec = None,
 ):
-    n_steps = int(x_max - x_min + 1)
-    x_values = np.linspace(x_min, x_max, n_steps)
+    """
+    Kernel density estimate of a sample's ages with a Gaussian kernel.
+
+    method="dense" evaluates every grain's kernel at every grid point and is
+    the reference implementation. method="fft" linearly bins the ages onto the
+    grid and convolves the bin counts with the kernel via FFT, which costs
+    O(N + G log G) instead of O(N * G). The binning error shrinks with
+    (grid step / bandwidth) ** 2: on the default 1 Ma grid the FFT curve is
+    within 0.1% of the dense curve's peak height at bandwidth 10 and within
+    0.5% at bandwidth 2. method="truncated" evaluates each kernel only within
+    8 bandwidths of its grain, like pdp_function.
+
+    chunk_size (grains per block) or max_memory (bytes of scratch space)
+    bound the dense path's working memory; see _dense_kernel_sum.
+
+    bandwidth may also be "auto"/"isj" or "lscv" to choose it from the data
+    with select_bandwidth.
+
+    With adaptive=True each grain gets its own bandwidth from a pilot KDE
+    (Abramson, 1982); see adaptive_bandwidths. Per-grain bandwidths are
+    evaluated like a PDP with method="truncated" or "dense", or with
+    method="fft" by binning the grains into narrow bandwidth classes and
+    convolving each class.
+
+    The curve is evaluated on `grid` if one is given, otherwise on the 1 Ma
+    grid from x_min to x_max.
+
+    If a DistributionCache is given, the curve is looked up there first and
+    stored there after it is computed.
+    """
+    grid = _resolve_grid(grid, x_min, x_max)
+    x_values = grid.x_values
+
+    if isinstance(bandwidth, str):
+        bandwidth = select_bandwidth(sample, bandwidth)
+
+    if cache is not None:
+        cache_method = f"{method}-adaptive-{sensitivity}" if adaptive else method
+        key = _cache_key(sample, "kde", grid, cache_method, bandwidth)
+        y_values = cache.get(key)
+        if y_values is not None:
+            return Distribution(sample.name, x_values, y_values, grid=grid)
+
+    ages = sample.ages
+    if adaptive:
+        bandwidths = adaptive_bandwidths(x_values, ages, bandwidth, sensitivity)
+    else:
+        bandwidths = np.full(len(ages), bandwidth, dtype=float)
+
+    if method == "dense":
+        y_values = _dense_kernel_sum(x_values, ages, bandwidths, chunk_size, max_memory)
+    elif method == "truncated":
+        y_values = _truncated_kernel_sum(x_values, ages, bandwidths)
+    elif method == "fft" and adaptive:
+        y_values = _binned_variable_kernel_sum(x_values, ages, bandwidths)
+    elif method == "fft":
+        y_values = _binned_kernel_sum(x_values, ages, bandwidth)
+    else:
+        raise ValueError(f"Unknown method '{method}'")
 
-    ages = np.array([grain.age for grain in sample.grains])
+    y_values /= np.sum(y_values)
+    if cache is not None:
+        cache.put(key, y_values)
+    return Distribution(sample.name, x_values, y_values, grid=grid)
 
-    ages_2d = ages[:, np.newaxis]
-    x_2d = x_values[np.newaxis, :]
 
-    diff_squared = (x_2d - ages_2d) ** 2
-    variance_2 = 2 * bandwidth ** 2
-    normalization = 1.0 / (np.sqrt(2 * np.pi) * bandwidth)
+def pdp_function(
+    sample: Sample,
+    x_min: float = 0,
+    x_max: float = 4500,
+    method: str = "dense",
+    n_sigma: float = 8,
+    chunk_size: int = None,
+    max_memory: int = None,
+    cache: DistributionCache = None,
+    grid: GridSpec = None,
+):
+    """
+    Probability density plot: the sum of one Gaussian per grain with the
+    grain's own uncertainty as its standard deviation.
+
+    method="dense" evaluates every grain over the whole grid. method="truncated"
+    evaluates each grain only within +/- n_sigma of its age and adds it into
+    the output, so the cost follows the total window width and memory stays
+    at one grid-length array. Beyond 8 sigma a Gaussian is below 1e-14 of its
+    peak, so the default n_sigma gives the dense result to rounding error.
+
+    chunk_size (grains per block) or max_memory (bytes of scratch space)
+    bound the dense path's working memory; see _dense_kernel_sum.
+
+    The curve is evaluated on `grid` if one is given, otherwise on the 1 Ma
+    grid from x_min to x_max.
 
-    kernels = normalization * np.exp(-diff_squared / variance_2)
-    y_values = np.sum(kernels, axis=0)
+    If a DistributionCache is given, the curve is looked up there first and
+    stored there after it is computed.
+    """
+    grid = _resolve_grid(grid, x_min, x_max)
+    x_values = grid.x_values
+
+    if cache is not None:
+        key = _cache_key(sample, "pdp", grid, method, n_sigma)
+        y_values = cache.get(key)
+        if y_values is not None:
+            return Distribution(sample.name, x_values, y_values, grid=grid)
+
+    ages = sample.ages
+    bandwidths = sample.uncertainties
+
+    if method == "dense":
+        y_values = _dense_kernel_sum(x_values, ages, bandwidths, chunk_size, max_memory)
+    elif method == "truncated":
+        y_values = _truncated_kernel_sum(x_values, ages, bandwidths, n_sigma)
+    else:
+        raise ValueError(f"Unknown method '{method}'")
 
     y_values /= np.sum(y_values)
-    return Distribution(sample.name, x_values, y_values)
+    if cache is not None:
+        cache.put(key, y_values)
+    return Distribution(sample.name, x_values, y_values, grid=grid)
 
 
-def pdp_function(sample: Sample, x_min: float = 0, x_max: float = 4500):
-    n_steps = int(x_max - x_min + 1)
-    x_values = np.linspace(x_min, x_max, n_steps)
+def distribution_set(
+    samples: [Sample],
+    function_type: str = "kde",
+    bandwidth: float = 10,
+    x_min: float = 0,
+    x_max: float = 4500,
+    method: str = "dense",
+    chunk_size: int = None,
+    max_memory: int = None,
+    cache: DistributionCache = None,
+    grid: GridSpec = None,
+):
+    """
+    Build the KDEs or PDPs of many samples in one pass into a DistributionSet.
 
-    ages = np.array([grain.age for grain in sample.grains])
-    bandwidths = np.array([grain.uncertainty for grain in sample.grains])
+    Rows match kde_function / pdp_function with the same arguments. With
+    function_type="kde" and method="fft" the ages of all samples are binned
+    together and convolved in a single batched FFT; the other engines fill
+    one preallocated row per sample. A string bandwidth is resolved per
+    sample with select_bandwidth.
 
-    ages_2d = ages[:, np.newaxis]
-    bandwidths_2d = bandwidths[:, np.newaxis]
-    x_2d = x_values[np.newaxis, :]
+    If a DistributionCache is given, cached rows are reused and only the
+    missing samples are computed (in one batch) and added to the cache.
 
-    diff_squared = (x_2d - ages_2d) ** 2
-    variance_2 = 2 * bandwidths_2d ** 2
-    normalization = 1.0 / (np.sqrt(2 * np.pi) * bandwidths_2d)
+    All rows share `grid` if one is given, otherwise the 1 Ma grid from
+    x_min to x_max.
+    """
+    grid = _resolve_grid(grid, x_min, x_max)
+    x_values = grid.x_values
+    names = [sample.name for sample in samples]
 
-    kernels = normalization * np.exp(-diff_squared / variance_2)
-    y_values = np.sum(kernels, axis=0)
+    if isinstance(bandwidth, str):
+        sample_bandwidths = [select_bandwidth(sample, bandwidth) for sample in samples]
+    else:
+        sample_bandwidths = [bandwidth] * len(samples)
+
+    if cache is not None:
+        # the cached parameter is the bandwidth for KDEs and pdp_function's default n_sigma for PDPs
+        parameters = sample_bandwidths if function_type == "kde" else [8] * len(samples)
+        keys = [
+            _cache_key(sample, function_type, grid, method, parameter)
+            for sample, parameter in zip(samples, parameters)
+        ]
+        rows = [cache.get(key) for key in keys]
+        missing = [i for i, row in enumerate(rows) if row is None]
+        if missing:
+            computed = distribution_set(
+                [samples[i] for i in missing], function_type, bandwidth, x_min, x_max, method, chunk_size, max_memory,
+                grid=grid,
+            )
+            for i, row in zip(missing, computed.y_values):
+                cache.put(keys[i], row)
+                rows[i] = row
+        return DistributionSet(names, x_values, np.vstack(rows) if rows else np.zeros((0, grid.n_steps)), grid=grid)
+
+    y_values = np.zeros((len(samples), grid.n_steps))
+
+    if function_type == "kde":
+        if method == "fft" and not isinstance(bandwidth, str):
+            ages = np.concatenate([sample.ages for sample in samples])
+            groups = np.repeat(np.arange(len(samples)), [len(sample.ages) for sample in samples])
+            y_values = _binned_kernel_sum(x_values, ages, bandwidth, groups=groups, n_groups=len(samples))
+        elif method == "fft":
+            for row, sample, sample_bandwidth in zip(y_values, samples, sample_bandwidths):
+                row[:] = _binned_kernel_sum(x_values, sample.ages, sample_bandwidth)
+        elif method == "dense":
+            for row, sample, sample_bandwidth in zip(y_values, samples, sample_bandwidths):
+                ages = sample.ages
+                bandwidths = np.full(len(ages), sample_bandwidth, dtype=float)
+                _dense_kernel_sum(x_values, ages, bandwidths, chunk_size, max_memory, out=row)
+        elif method == "truncated":
+            for row, sample, sample_bandwidth in zip(y_values, samples, sample_bandwidths):
+                ages = sample.ages
+                bandwidths = np.full(len(ages), sample_bandwidth, dtype=float)
+                _truncated_kernel_sum(x_values, ages, bandwidths, out=row)
+        else:
+            raise ValueError(f"Unknown method '{method}'")
+    elif function_type == "pdp":
+        for row, sample in zip(y_values, samples):
+            ages = sample.ages
+            bandwidths = sample.uncertainties
+            if method == "dense":
+                _dense_kernel_sum(x_values, ages, bandwidths, chunk_size, max_memory, out=row)
+            elif method == "truncated":
+                _truncated_kernel_sum(x_values, ages, bandwidths, out=row)
+            else:
+                raise ValueError(f"Unknown method '{method}'")
+    else:
+        raise ValueError(f"Unknown function type '{function_type}'")
 
-    y_values /= np.sum(y_values)
-    return Distribution(sample.name, x_values, y_values)
+    y_values /= np.sum(y_values, axis=1, keepdims=True)
+    return DistributionSet(names, x_values, y_values, grid=grid)
 
 
 def cdf_function(distribution: Distribution):
-    cdf = np.cumsum(distribution.y_values)
-    cdf /= cdf[-1]
-    return Distribution(distribution.name, distribution.x_values, cdf)
+    cdf = np.cumsum(distribution.y_values, axis=-1)
+    cdf /= cdf[..., -1:]
+    if isinstance(distribution, DistributionSet):
+        return DistributionSet(distribution.names, distribution.x_values, cdf, grid=distribution.grid)
+    return Distribution(distribution.name, distribution.x_values, cdf, grid=distribution.grid)
+
+
+def analytic_cdf_function(
+    samples,
+    function_type: str = "kde",
+    bandwidth: float = 10,
+    x_min: float = 0,
+    x_max: float = 4500,
+    n_sigma: float = 8,
+    normalize: bool = True,
+    grid: GridSpec = None,
+):
+    """
+    CDF of a sample's KDE or PDP evaluated exactly as the mean of per-grain
+    normal CDFs, instead of by cumulative summation of a discretised PDF.
+
+    Takes one Sample (returns a Distribution) or a list of Samples (returns a
+    DistributionSet). Each grain's normal CDF is evaluated only within
+    +/- n_sigma of its age; grid points right of that window get 1 from a
+    count of the grains that lie wholly to their left. With
+    function_type="kde" and bandwidth=0 the result is the empirical CDF,
+    evaluated with searchsorted. With normalize=True the curve is scaled to
+    end at 1, as cdf_function does.
+    """
+    grid = _resolve_grid(grid, x_min, x_max)
+    x_values = grid.x_values
+    single = isinstance(samples, Sample)
+    if single:
+        samples = [samples]
+    if function_type not in ("kde", "pdp"):
+        raise ValueError(f"Unknown function type '{function_type}'")
+
+    cdf = np.zeros((len(samples), grid.n_steps))
+    if function_type == "kde" and bandwidth == 0:
+        for row, sample in zip(cdf, samples):
+            row[:] = np.searchsorted(np.sort(sample.ages), x_values, side='right')
+    else:
+        # all grains of all samples in one pass, each tagged with its sample's row
+        if function_type == "pdp":
+            sigmas = [sample.uncertainties for sample in samples]
+        elif isinstance(bandwidth, str):
+            sigmas = [np.full(len(sample.ages), select_bandwidth(sample, bandwidth)) for sample in samples]
+        else:
+            sigmas = [np.full(len(sample.ages), bandwidth, dtype=float) for sample in samples]
+        ages = np.concatenate([sample.ages for sample in samples]) if samples else np.zeros(0)
+        sigmas = np.concatenate(sigmas) if samples else np.zeros(0)
+        groups = np.repeat(np.arange(len(samples)), [len(sample.ages) for sample in samples])
+        _truncated_cdf_sum(x_values, ages, sigmas, n_sigma, out=cdf, groups=groups, n_groups=len(samples))
+    cdf /= np.array([max(len(sample.ages), 1) for sample in samples])[:, np.newaxis]
+    if normalize:
+        cdf /= cdf[:, -1:]
+
+    names = [sample.name for sample in samples]
+    if single:
+        return Distribution(names[0], x_values, cdf[0], grid=grid)
+    return DistributionSet(names, x_values, cdf, grid=grid)
 
 
 # ----------------------------------------------------------------------
@@ -384,6 +1194,16 @@ def _position_mode_labels(modes, x_values, y_values, x_range, font_size):
     return positions
 
 
+def _distribution_modes(distributions: list, n_modes: int):
+    # One batched pass when the distributions share a grid, otherwise one per distribution
+    try:
+        check_grids(distributions)
+    except ValueError:
+        return [find_modes(dist.x_values, dist.y_values, n_modes) for dist in distributions]
+    y_values = np.vstack([dist.y_values for dist in distributions])
+    return find_modes_batch(distributions[0].x_values, y_values, n_modes)
+
+
 # ----------------------------------------------------------------------
 # Plotting
 # ----------------------------------------------------------------------
@@ -413,6 +1233,9 @@ def distribution_graph(
     else:
         font = fonts.get_default_font()
 
+    if modes_labeled > 0:
+        all_modes = _distribution_modes(distributions, modes_labeled)
+
     if not stacked:
         fig, ax = plt.subplots(figsize=(fig_width, fig_height), dpi=100, squeeze=False)
         ax_list = [ax[0, 0]]
@@ -435,7 +1258,7 @@ def distribution_graph(
                 )
 
             if modes_labeled > 0:
-                modes = find_modes(x, y, modes_labeled)
+                modes = all_modes[i]
                 positions = _position_mode_labels(modes, x, y, (x_min, x_max), font_size)
 
                 for (px, py, x_offset, y_offset, needs_line) in positions:
@@ -500,7 +1323,7 @@ def distribution_graph(
                 )
 
             if modes_labeled > 0:
-                modes = find_modes(x, y, modes_labeled)
+                modes = all_modes[i]
                 positions = _position_mode_labels(modes, x, y, (x_min, x_max), font_size)
 
                 for (px, py, x_offset, y_offset, needs_line) in positions:
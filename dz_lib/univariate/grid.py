@@ -0,0 +1,77 @@
+import numpy as np
+
+
+class GridSpec:
+    """
+    Immutable, evenly spaced age grid shared by distribution builders.
+
+    The grid runs from x_min in steps of `step` up to the last point that
+    does not exceed x_max. Its x values are computed once and returned as a
+    read-only array, so every distribution built on one GridSpec shares the
+    same x array. Use a coarse step for fast screening and a sub-Ma step for
+    young MDA work.
+    """
+    __slots__ = ('_x_min', '_x_max', '_step', '_x_values')
+
+    def __init__(self, x_min: float = 0, x_max: float = 4500, step: float = 1.0):
+        if step <= 0:
+            raise ValueError(f"Grid step must be positive, got {step}.")
+        if x_max <= x_min:
+            raise ValueError(f"x_max must be greater than x_min, got {x_min} and {x_max}.")
+        n_steps = int(np.floor((x_max - x_min) / step + 1e-9)) + 1
+        x_values = x_min + step * np.arange(n_steps)
+        x_values.flags.writeable = False
+        object.__setattr__(self, '_x_min', float(x_min))
+        object.__setattr__(self, '_x_max', float(x_values[-1]))
+        object.__setattr__(self, '_step', float(step))
+        object.__setattr__(self, '_x_values', x_values)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("GridSpec is immutable.")
+
+    @property
+    def x_min(self):
+        return self._x_min
+
+    @property
+    def x_max(self):
+        return self._x_max
+
+    @property
+    def step(self):
+        return self._step
+
+    @property
+    def n_steps(self):
+        return len(self._x_values)
+
+    @property
+    def x_values(self):
+        return self._x_values
+
+    def __len__(self):
+        return self.n_steps
+
+    def __eq__(self, other):
+        if not isinstance(other, GridSpec):
+            return NotImplemented
+        return (self.x_min, self.step, self.n_steps) == (other.x_min, other.step, other.n_steps)
+
+    def __hash__(self):
+        return hash((self.x_min, self.step, self.n_steps))
+
+    def __repr__(self):
+        return f"GridSpec(x_min={self.x_min!r}, x_max={self.x_max!r}, step={self.step!r})"
+
+    def refined(self, factor: int):
+        """The same bounds with `factor` times as many steps."""
+        return GridSpec(self.x_min, self.x_max, self.step / factor)
+
+    def check_compatible(self, other):
+        if other != self:
+            raise ValueError(f"Incompatible grids: {self!r} and {other!r}.")
+
+
+def default_grid(x_min: float = 0, x_max: float = 4500):
+    """The library's standard 1 Ma grid between x_min and x_max."""
+    return GridSpec(x_min, x_max, 1.0)
@@ -99,7 +99,7 @@ def histogram_graph(
         ax_list = [ax[0, 0]]
 
         sample = samples[0]
-        ages = [g.age for g in sample.grains]
+        ages = sample.ages
 
         ax[0, 0].hist(
             ages,
@@ -127,7 +127,7 @@ def histogram_graph(
             ax = fig.add_subplot(gs[i])
             ax_list.append(ax)
 
-            ages = [g.age for g in sample.grains]
+            ages = sample.ages
 
             ax.hist(
                 ages,
@@ -284,7 +284,7 @@ def histogram_pie_chart(
 
     # Draw pies
     for ax, sample in axes_samples:
-        ages = np.array([g.age for g in sample.grains])
+        ages = sample.ages
         counts = bin_list.count(ages)
 
         nonzero = counts > 0
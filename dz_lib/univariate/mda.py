@@ -3,6 +3,7 @@
 
 from dz_lib.univariate.data import Grain, Sample
 from dz_lib.univariate import distributions
+from dz_lib.univariate.grid import GridSpec, default_grid
 import numpy as np
 import scipy.stats as stats
 import peakutils
@@ -15,10 +16,12 @@ import pandas as pd
 
 
 # MDA functions:
+# Each accepts either a Sample or a list of grains.
 def youngest_single_grain(grains: [Grain]) -> (Grain, float):
-    sorted_grains = sorted(grains, key=lambda grain: grain.age)
+    ages, uncertainties = _grain_arrays(grains)
+    i = np.argmin(ages)
     n = 1.0
-    return sorted_grains[0], n
+    return Grain(float(ages[i]), float(uncertainties[i])), n
 
 
 def youngest_cluster_1s(
@@ -26,33 +29,28 @@ def youngest_cluster_1s(
         min_cluster_size: int = 2,
         include_yg: bool = True
 ) -> (Grain, int, float):
-    sorted_grains = sorted(grains, key=lambda grain: grain.age + grain.uncertainty)
-    ygc1s_hi = [grain.age + grain.uncertainty for grain in sorted_grains]
-    ygc1s_lo = [grain.age - grain.uncertainty for grain in sorted_grains]
-    ygc1s_data = []
+    ages, uncertainties = _grain_arrays(grains)
+    order = np.argsort(ages + uncertainties, kind='stable')
+    ages, uncertainties = ages[order], uncertainties[order]
+    ygc1s_hi = ages + uncertainties
+    ygc1s_lo = ages - uncertainties
+    n = len(ages)
     if include_yg:
-        for lo in ygc1s_lo:
-            if lo >= ygc1s_hi[0]:
-                break
-            ygc1s_data.append(sorted_grains[ygc1s_lo.index(lo)])
+        # grains up to the first one that no longer overlaps the youngest
+        end = _first_true(ygc1s_lo >= ygc1s_hi[0], n) if n else 0
+        start = 0
     else:
-        n = len(ygc1s_hi)
-        YGC1s_mat = [[ygc1s_hi[i] > ygc1s_lo[j] for j in range(n)] for i in range(n)]
-        i = 0
-        for idx in range(n - 1):
-            if YGC1s_mat[idx + 1][idx]:
-                i = idx
-                break
-        YGC1s_idx = next((j for j, val in enumerate(YGC1s_mat[i]) if not val), n)
-        ygc1s_data = sorted_grains[i:YGC1s_idx]
-    if not ygc1s_data or len(ygc1s_data) < min_cluster_size:
+        # the first pair of neighbours that overlap, extended while grains overlap it
+        start = _first_true(ygc1s_hi[1:] > ygc1s_lo[:-1], 0)
+        end = _first_true(~(ygc1s_hi[start] > ygc1s_lo), n) if n else 0
+    if end - start < max(min_cluster_size, 1):
         return Grain(float('nan'), float('nan')), 0, float('nan')
-    weighted_mean, uncertainty, mswd = get_weighted_mean(
-        grains=ygc1s_data,
+    weighted_mean, uncertainty, mswd = _weighted_mean(
+        ages[start:end], uncertainties[start:end],
         confidence_level=0.95
     )
     weighted_grain = Grain(age=weighted_mean, uncertainty=uncertainty)
-    return weighted_grain, len(ygc1s_data), mswd
+    return weighted_grain, end - start, mswd
 
 
 def youngest_cluster_2s(
@@ -60,40 +58,38 @@ def youngest_cluster_2s(
         min_cluster_size: int = 3,
         include_yg: bool = True
 ) -> (Grain, int, float):
-    sorted_grains = sorted(grains, key=lambda g: g.age + 2 * g.uncertainty)
-    ygc2s_hi = [g.age + 2 * g.uncertainty for g in sorted_grains]
-    ygc2s_lo = [g.age - 2 * g.uncertainty for g in sorted_grains]
-    youngest_cluster = []
+    ages, uncertainties = _grain_arrays(grains)
+    order = np.argsort(ages + 2 * uncertainties, kind='stable')
+    ages, uncertainties = ages[order], uncertainties[order]
+    ygc2s_hi = ages + 2 * uncertainties
+    ygc2s_lo = ages - 2 * uncertainties
+    n = len(ages)
     if include_yg:
-        for i, lo in enumerate(ygc2s_lo):
-            if lo >= ygc2s_hi[0]:
-                break
-            youngest_cluster.append(sorted_grains[i])
+        end = _first_true(ygc2s_lo >= ygc2s_hi[0], n) if n else 0
+        start = 0
     else:
-        ygc2s_mat = [[hi > lo_i for lo_i in ygc2s_lo] for hi in ygc2s_hi]
-        for i in range(len(ygc2s_mat) - 2):
-            if ygc2s_mat[i + 1][i] and ygc2s_mat[i + 2][i]:
-                break
-        ygc2s_idx = next((j for j, x in enumerate(ygc2s_mat[i]) if not x), len(sorted_grains))
-        youngest_cluster = sorted_grains[i:ygc2s_idx]
-    if len(youngest_cluster) < min_cluster_size:
+        # the first grain overlapped by both of the next two, else the third from last
+        overlapped = (ygc2s_hi[1:-1] > ygc2s_lo[:-2]) & (ygc2s_hi[2:] > ygc2s_lo[:-2])
+        start = _first_true(overlapped, max(n - 3, 0))
+        end = _first_true(~(ygc2s_hi[start] > ygc2s_lo), n) if n else 0
+    if end - start < min_cluster_size:
         return Grain(float('nan'), float('nan')), 0, float('nan')
-    weighted_mean, uncertainty, mswd = get_weighted_mean(
-        grains=youngest_cluster,
+    weighted_mean, uncertainty, mswd = _weighted_mean(
+        ages[start:end], uncertainties[start:end],
         confidence_level=0.95
     )
 
     weighted_grain = Grain(age=weighted_mean, uncertainty=uncertainty)
-    return weighted_grain, len(youngest_cluster), mswd
+    return weighted_grain, end - start, mswd
 
 
 def youngest_3_zircons(grains: [Grain]) -> (Grain, int, float):
     if len(grains) < 3:
         return None, float('nan')
-    sorted_grains = sorted(grains, key=lambda grain: grain.age)
-    youngest_three = sorted_grains[:3]
-    weighted_mean, uncertainty, mswd = get_weighted_mean(
-        grains=youngest_three,
+    ages, uncertainties = _grain_arrays(grains)
+    youngest_three = np.argsort(ages, kind='stable')[:3]
+    weighted_mean, uncertainty, mswd = _weighted_mean(
+        ages[youngest_three], uncertainties[youngest_three],
         confidence_level=0.8
     )
     weighted_grain = Grain(age=weighted_mean, uncertainty=uncertainty)
@@ -104,10 +100,10 @@ def youngest_3_zircons(grains: [Grain]) -> (Grain, int, float):
 def youngest_3_zircons_overlap(grains: [Grain], sigma: int=2) -> (Grain, int, float):
     if len(grains) < 3:
         return Grain(age=0, uncertainty=0), 0, 0  # Match MATLAB output
-    sorted_grains = sorted(grains, key=lambda g: g.age + sigma * g.uncertainty)
-    youngest_cluster = sorted_grains[:3]
-    weighted_mean, uncertainty_1s, mswd = get_weighted_mean(
-        grains=youngest_cluster
+    ages, uncertainties = _grain_arrays(grains)
+    youngest_cluster = np.argsort(ages + sigma * uncertainties, kind='stable')[:3]
+    weighted_mean, uncertainty_1s, mswd = _weighted_mean(
+        ages[youngest_cluster], uncertainties[youngest_cluster]
     )
     n = len(youngest_cluster)
     weighted_grain = Grain(age=weighted_mean, uncertainty=uncertainty_1s)
@@ -122,10 +118,10 @@ def youngest_graphical_peak(
         x_min: float = 0,
         x_max: float = 4500,
 ) -> float:
-    if not grains:
+    if len(grains) == 0:
         print("No grains provided.")
         return float('nan')
-    distro = distributions.pdp_function(Sample("temp", grains), x_min=x_min, x_max=x_max)
+    distro = distributions.pdp_function(_as_sample(grains), x_min=x_min, x_max=x_max)
     if not distro.x_values.any() or not distro.y_values.any():
         print("Empty distribution data.")
         return float('nan')
@@ -155,22 +151,24 @@ def youngest_statistical_population(
     sigma: float = 1.0,
     add_uncertainty: bool=False
 ) -> (Grain, int, float):
+    ages, uncertainties = _grain_arrays(grains)
     if add_uncertainty:
-        sorted_grains = sorted(grains, key=lambda g: g.age + sigma * g.uncertainty)
+        order = np.argsort(ages + sigma * uncertainties, kind='stable')
     else:
-        sorted_grains = sorted(grains, key=lambda g: g.age)
+        order = np.argsort(ages, kind='stable')
+    ages, uncertainties = ages[order], uncertainties[order]
     best_grain = None
     best_mswd = float('nan')
     best_count = 0
-    for j in range(len(sorted_grains) - min_cluster_size + 1):
-        subset = sorted_grains[: j + min_cluster_size]
-        wm_age, wm_err1s, mswd = get_weighted_mean(subset)
+    for j in range(len(ages) - min_cluster_size + 1):
+        subset_size = j + min_cluster_size
+        wm_age, wm_err1s, mswd = _weighted_mean(ages[:subset_size], uncertainties[:subset_size])
         if j == 0 and mswd > mswd_threshold:
             continue
         if abs(mswd - 1) < abs(best_mswd - 1) if not np.isnan(best_mswd) else True:
             best_grain = Grain(age=wm_age, uncertainty=wm_err1s)
             best_mswd = mswd
-            best_count = len(subset)
+            best_count = subset_size
         if mswd > 1:
             break
     return best_grain, best_count if best_grain else (None, float('nan'), 0), best_mswd
@@ -178,30 +176,33 @@ def youngest_statistical_population(
 
 def tau_method(grains: list[Grain], mode_req: int=3, thres: float = 0.01, min_dist: int = 1, x1: float = 0,
                x2: float = 4500):
-    sample = Sample(name="temp", grains=grains)
+    sample = _as_sample(grains)
     distro = distributions.pdp_function(sample, x_min=x1, x_max=x2)
     x_values = distro.x_values
     y_values = distro.y_values
     trough_indexes = list(peakutils.indexes(-np.array(y_values), thres=thres, min_dist=min_dist))
     boundaries = [x1] + list(x_values[trough_indexes]) + [x2]
-    selected_grains = None
+    selected = None
     for j in range(len(boundaries) - 1):
         lower_bound = boundaries[j]
         upper_bound = boundaries[j + 1]
-        candidate = [grain for grain in grains if lower_bound <= grain.age <= upper_bound]
-        if len(candidate) >= mode_req:
-            selected_grains = candidate
+        candidate = (sample.ages >= lower_bound) & (sample.ages <= upper_bound)
+        if np.count_nonzero(candidate) >= mode_req:
+            selected = candidate
             break
-    if not selected_grains or len(selected_grains) < mode_req:
+    if selected is None:
         return Grain(float('nan'), float('nan')), 0, float('nan')
-    tau_wm, tau_wm_err, tau_wm_mswd = get_weighted_mean(selected_grains, confidence_level=0.95)
-    return Grain(age=tau_wm, uncertainty=tau_wm_err), len(selected_grains), tau_wm_mswd
+    tau_wm, tau_wm_err, tau_wm_mswd = _weighted_mean(
+        sample.ages[selected], sample.uncertainties[selected], confidence_level=0.95
+    )
+    return Grain(age=tau_wm, uncertainty=tau_wm_err), int(np.count_nonzero(selected)), tau_wm_mswd
 
 
-def youngest_gaussian_fit(grains: [Grain], x_min=0, x_max=4500):
-    n_steps = 10 * x_max - x_min + 1
-    temp_sample = Sample("temp", grains)
-    distro = distributions.pdp_function(temp_sample)
+def youngest_gaussian_fit(grains: [Grain], x_min=0, x_max=4500, grid: GridSpec = None):
+    if grid is None:
+        grid = default_grid(x_min, x_max)
+    temp_sample = _as_sample(grains)
+    distro = distributions.pdp_function(temp_sample, grid=grid)
 
     x_values = np.array(distro.x_values)
     y_values = np.array(distro.y_values)
@@ -240,20 +241,36 @@ def youngest_gaussian_fit(grains: [Grain], x_min=0, x_max=4500):
     a_fit, mu_fit, sigma_fit = params
     YGF_1s = sigma_fit / np.sqrt(2)  # 1 sigma
 
-    # Generate fitted distribution curve
-    x_fit = np.linspace(x_values.min(), x_values.max(), n_steps)
+    # Generate fitted distribution curve on a 10x finer grid
+    fit_grid = grid.refined(10)
+    x_fit = fit_grid.x_values
     y_fit = gaussian(x_fit, *params)
 
     # Create the output objects
     fitted_grain = Grain(mu_fit, YGF_1s)
     fitted_distro = distributions.Distribution(
         f"Youngest Gaussian Fit\nMean: {mu_fit:.2f} Ma\n1σ: {YGF_1s:.2f}",
-        x_fit, y_fit
+        x_fit, y_fit, grid=fit_grid
     )
     return fitted_grain, fitted_distro
 
 # MDA utils:
 # Not usually used outside of this library
+def _grain_arrays(grains):
+    # Ages and uncertainties of a Sample or a list of grains as float arrays
+    if isinstance(grains, Sample):
+        return grains.ages, grains.uncertainties
+    ages = np.array([grain.age for grain in grains], dtype=float)
+    uncertainties = np.array([grain.uncertainty for grain in grains], dtype=float)
+    return ages, uncertainties
+
+def _as_sample(grains):
+    return grains if isinstance(grains, Sample) else Sample("temp", grains)
+
+def _first_true(mask, default: int) -> int:
+    # Index of the first True in mask, or default if there is none
+    return int(np.argmax(mask)) if np.any(mask) else default
+
 def count_bins_around_peak(peak_age: float, distribution: distributions.Distribution, window: float = 1.0) -> int:
     return sum(1 for x in distribution.x_values if abs(x - peak_age) <= window / 2)
 
@@ -293,10 +310,13 @@ def get_weighted_mean(
         grains: [Grain],
         confidence_level: float = 0.95
 ) -> [float, float, float]:
-    if not grains:
+    if len(grains) == 0:
         raise ValueError("Grains list cannot be empty.")
-    ages = np.array([grain.age for grain in grains], dtype=float)
-    errors = np.array([grain.uncertainty for grain in grains], dtype=float)
+    ages, errors = _grain_arrays(grains)
+    return _weighted_mean(ages, errors, confidence_level)
+
+
+def _weighted_mean(ages, errors, confidence_level: float = 0.95):
     if np.any(errors == 0):
         raise ValueError("Grain uncertainties cannot be zero.")
     weight = 1 / errors ** 2
@@ -325,25 +345,18 @@ def ranked_ages_plot(
         color_1s: str = "black",
         color_2s: str = "cornflowerblue",
 ):
+    ages, uncertainties = _grain_arrays(grains)
+    uncertainties = np.abs(uncertainties)
     if sort_with_uncertainty:
-        sorted_grains = sorted(grains, key=lambda grain: grain.age + abs(grain.uncertainty)*2)
+        order = np.argsort(ages + uncertainties * 2, kind='stable')
     else:
-        sorted_grains = sorted(grains, key=lambda grain: grain.age)
-    ages = np.array([grain.age for grain in sorted_grains])
-    uncertainties = np.array([abs(grain.uncertainty) for grain in sorted_grains])
-    ranks = range(len(sorted_grains))
+        order = np.argsort(ages, kind='stable')
+    ages, uncertainties = ages[order], uncertainties[order]
+    # grains outside the plotted range keep their rank among all grains
+    in_range = (ages > x_min) & (ages < x_max)
+    ranks = np.arange(len(ages))[in_range]
+    ages, uncertainties = ages[in_range], uncertainties[in_range]
     fig, ax = plt.subplots(figsize=(fig_width, fig_height), dpi=100)
-    trimmed_ages = []
-    trimmed_uncertainties = []
-    trimmed_ranks = []
-    for i, age in enumerate(ages):
-        if x_min < age < x_max:
-            trimmed_ages.append(age)
-            trimmed_uncertainties.append(uncertainties[i])
-            trimmed_ranks.append(ranks[i])
-    ages = np.array(trimmed_ages)
-    uncertainties = np.array(trimmed_uncertainties)
-    ranks = np.array(trimmed_ranks)
     ax.scatter(ages, ranks, facecolors='white', edgecolors="k", marker='d', s=100, zorder=10)
     ax.hlines(ranks, ages - 2 * uncertainties, ages + 2 * uncertainties, color=color_2s, linewidth=4, label='2σ')
     ax.hlines(ranks, ages - uncertainties, ages + uncertainties, color=color_1s, linewidth=4, label='1σ')
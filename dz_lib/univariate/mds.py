@@ -12,51 +12,145 @@ class MDSPoint:
         self.label = label
         self.nearest_neighbor = nearest_neighbor
 
-def _compute_dissimilarity_matrix(samples: [Sample], metric: str = "similarity"):
-    n_samples = len(samples)
-    dissimilarity_matrix = np.zeros((n_samples, n_samples))
-    prob_distros = [distributions.pdp_function(sample) for sample in samples]
-    c_distros = [distributions.cdf_function(prob_distro) for prob_distro in prob_distros]
-    
-    for i in range(n_samples):
-        for j in range(i + 1, n_samples):
-            if metric == "similarity":
-                dissimilarity_matrix[i, j] = metrics.dis_similarity(prob_distros[i].y_values, prob_distros[j].y_values)
-            elif metric == "likeness":
-                dissimilarity_matrix[i, j] = metrics.dis_likeness(prob_distros[i].y_values, prob_distros[j].y_values)
-            elif metric == "cross_correlation":
-                dissimilarity_matrix[i, j] = metrics.dis_r2(prob_distros[i].y_values, prob_distros[j].y_values)
-            elif metric == "ks":
-                dissimilarity_matrix[i, j] = metrics.ks(c_distros[i].y_values, c_distros[j].y_values)
-            elif metric == "kuiper":
-                dissimilarity_matrix[i, j] = metrics.kuiper(c_distros[i].y_values, c_distros[j].y_values)
-            else:
-                raise ValueError(f"Unknown metric '{metric}'")
-            dissimilarity_matrix[j, i] = dissimilarity_matrix[i, j]
-    
+# MDS metric name -> (pairwise dissimilarity kernel, curve type it compares)
+_DISSIMILARITY_KERNELS = {
+    "similarity": (metrics.dis_similarity_matrix, "density"),
+    "likeness": (metrics.dis_likeness_matrix, "density"),
+    "cross_correlation": (metrics.dis_r2_matrix, "density"),
+    "ks": (metrics.ks_matrix, "cdf"),
+    "kuiper": (metrics.kuiper_matrix, "cdf"),
+}
+
+# KS/Kuiper -> exact two-sample kernel on raw ages
+_ECDF_KERNELS = {
+    "ks": metrics.ks_ecdf_matrix,
+    "kuiper": metrics.kuiper_ecdf_matrix,
+}
+
+def _compute_dissimilarity_matrix(
+        samples: [Sample],
+        metric: str = "similarity",
+        function_type: str = "pdp",
+        cdf_method: str = "cumsum",
+):
+    """
+    (n, n) dissimilarity matrix between samples, from one pairwise kernel call.
+
+    Only the curves the metric needs are built, once for all samples, as a
+    DistributionSet of KDEs or PDPs (per function_type) and, for ks and
+    kuiper, their CDFs. cdf_method is "cumsum" (cumulative sum of the
+    density), "analytic" (analytic_cdf_function) or "ecdf" (exact
+    two-sample statistics on the grain ages, which builds no curves).
+    Returns the matrix and the density and CDF sets, either of which is
+    None if it was not needed.
+    """
+    if metric not in _DISSIMILARITY_KERNELS:
+        raise ValueError(f"Unknown metric '{metric}'")
+    kernel, curve_type = _DISSIMILARITY_KERNELS[metric]
+    prob_distros, c_distros = None, None
+    if curve_type == "density":
+        prob_distros = distributions.distribution_set(samples, function_type=function_type)
+        dissimilarity_matrix = kernel(prob_distros.y_values)
+    elif cdf_method == "ecdf":
+        dissimilarity_matrix = _ECDF_KERNELS[metric]([sample.ages for sample in samples])
+    elif cdf_method == "analytic":
+        c_distros = distributions.analytic_cdf_function(samples, function_type=function_type)
+        dissimilarity_matrix = kernel(c_distros.y_values)
+    elif cdf_method == "cumsum":
+        prob_distros = distributions.distribution_set(samples, function_type=function_type)
+        c_distros = distributions.cdf_function(prob_distros)
+        dissimilarity_matrix = kernel(c_distros.y_values)
+    else:
+        raise ValueError(f"Unknown CDF method '{cdf_method}'")
+    np.fill_diagonal(dissimilarity_matrix, 0)
     return dissimilarity_matrix, prob_distros, c_distros
 
-def _compute_mds(dissimilarity_matrix, non_metric: bool=True):
-    mds_result = MDS(n_components=2, dissimilarity='precomputed', metric=(not non_metric))
-    scaled_mds_result = mds_result.fit_transform(dissimilarity_matrix)
+def _nearest_neighbors(dissimilarity_matrix):
+    # Index of each sample's least dissimilar other sample (first one on ties)
+    masked = np.array(dissimilarity_matrix, dtype=float)
+    np.fill_diagonal(masked, np.inf)
+    return np.argmin(masked, axis=1)
+
+def _classical_mds(dissimilarity_matrix, n_components: int = 2):
+    """
+    Classical (Torgerson) MDS: coordinates from the top eigenvectors of the
+    double-centred squared dissimilarity matrix. Deterministic up to the sign
+    of each axis, which is fixed here so the largest coordinate is positive.
+    """
+    dissimilarity_matrix = np.asarray(dissimilarity_matrix, dtype=float)
+    n_samples = len(dissimilarity_matrix)
+    squared = dissimilarity_matrix ** 2
+    centred = squared - squared.mean(axis=0) - squared.mean(axis=1)[:, None] + squared.mean()
+    eigenvalues, eigenvectors = np.linalg.eigh(-0.5 * centred)
+    order = np.argsort(eigenvalues)[::-1][:n_components]
+    eigenvalues, eigenvectors = eigenvalues[order], eigenvectors[:, order]
+    signs = np.sign(eigenvectors[np.argmax(np.abs(eigenvectors), axis=0), np.arange(len(order))])
+    coordinates = eigenvectors * signs * np.sqrt(np.clip(eigenvalues, 0, None))
+    if coordinates.shape[1] < n_components:
+        coordinates = np.hstack([coordinates, np.zeros((n_samples, n_components - coordinates.shape[1]))])
+    return coordinates
+
+def _compute_mds(
+        dissimilarity_matrix,
+        non_metric: bool=True,
+        warm_start: bool=True,
+        n_init: int=4,
+        max_iter: int=300,
+        eps: float=1e-6,
+        random_state=None,
+        n_jobs: int=None,
+):
+    """
+    Fit 2D MDS to a precomputed dissimilarity matrix with sklearn's SMACOF.
+
+    With warm_start=True, SMACOF runs once from the classical MDS solution,
+    which usually converges in fewer iterations and gives the same result
+    every run. Otherwise it runs n_init times from random starts (seeded by
+    random_state) and keeps the lowest stress.
+    """
+    mds_result = MDS(
+        n_components=2,
+        metric='precomputed',
+        metric_mds=(not non_metric),
+        init='classical_mds' if warm_start else 'random',
+        n_init=1 if warm_start else n_init,
+        max_iter=max_iter,
+        eps=eps,
+        random_state=random_state,
+        n_jobs=n_jobs,
+    )
+    # sklearn's own classical start leaves axis signs arbitrary; ours fixes them
+    init = _classical_mds(dissimilarity_matrix) if warm_start else None
+    scaled_mds_result = mds_result.fit_transform(dissimilarity_matrix, init=init)
     return mds_result, scaled_mds_result
 
-def mds_function(samples: [Sample], metric: str = "similarity", non_metric: bool = True):
+def mds_function(
+        samples: [Sample],
+        metric: str = "similarity",
+        non_metric: bool = True,
+        function_type: str = "pdp",
+        cdf_method: str = "cumsum",
+        warm_start: bool = True,
+        n_init: int = 4,
+        max_iter: int = 300,
+        eps: float = 1e-6,
+        random_state=None,
+        n_jobs: int = None,
+):
     n_samples = len(samples)
-    dissimilarity_matrix, prob_distros, c_distros = _compute_dissimilarity_matrix(samples, metric)
-    mds_result, scaled_mds_result = _compute_mds(dissimilarity_matrix, non_metric=non_metric)
+    dissimilarity_matrix, prob_distros, c_distros = _compute_dissimilarity_matrix(
+        samples, metric, function_type=function_type, cdf_method=cdf_method
+    )
+    mds_result, scaled_mds_result = _compute_mds(
+        dissimilarity_matrix, non_metric=non_metric, warm_start=warm_start, n_init=n_init,
+        max_iter=max_iter, eps=eps, random_state=random_state, n_jobs=n_jobs,
+    )
     points = []
-    for i in range(n_samples):
-        distance = float('inf')
-        nearest_sample = None
-        for j in range(n_samples):
-            if i != j:
-                if dissimilarity_matrix[i, j] < distance:
-                    distance = dissimilarity_matrix[i, j]
-                    nearest_sample = samples[j]
-        if nearest_sample is not None:
+    if n_samples > 1:
+        nearest = _nearest_neighbors(dissimilarity_matrix)
+        for i in range(n_samples):
             x1, y1 = scaled_mds_result[i]
-            x2, y2 = scaled_mds_result[samples.index(nearest_sample)]
+            x2, y2 = scaled_mds_result[nearest[i]]
             points.append(MDSPoint(x1, y1, samples[i].name, nearest_neighbor=(x2, y2)))
     stress = mds_result.stress_
     return points, stress, dissimilarity_matrix, scaled_mds_result, mds_result
@@ -1,30 +1,41 @@
 # measures.py by Kurt Sundell, interpreted by Ryan Nielsen to work directly with detrital zircon samples.
 import numpy as np
 
+def _check_same_grid(y1_values, y2_values):
+    if np.shape(y1_values) != np.shape(y2_values):
+        raise ValueError(
+            f"Curves must be on the same grid, got shapes {np.shape(y1_values)} and {np.shape(y2_values)}."
+        )
+
 # KS Test (Massey, 1951) is the max absolute difference btw 2 CDF curves
 def ks(y1_values, y2_values):
-    d_val = max(abs(y1_values - y2_values))
+    _check_same_grid(y1_values, y2_values)
+    d_val = np.max(np.abs(y1_values - y2_values))
     return d_val
 
 # Kuiper test (Kuiper, 1960) is the sum of the max difference of CDF1 - CDF2 and CDF2 - CDF1
 def kuiper(y1_values, y2_values):
-    v_val = max(y1_values - y2_values) + max(y2_values - y1_values)
+    _check_same_grid(y1_values, y2_values)
+    v_val = np.max(y1_values - y2_values) + np.max(y2_values - y1_values)
     return v_val
 
 # Similarity (Gehrels, 2000) is the sum of the geometric mean of each point along x for two PDPs or KDEs
 def similarity(y1_values, y2_values):
+    _check_same_grid(y1_values, y2_values)
     similarity = np.sum(np.sqrt(y1_values * y2_values))
     return similarity
 
 # Likeness (Satkoski et al., 2013) is the complement to Mismatch (Amidon et al., 2005) and is the sum of the
 # absolute difference divided by 2 for every pair of points along x for two PDPs or KDEs
 def likeness(y1_values, y2_values):
+    _check_same_grid(y1_values, y2_values)
     likeness = 1 - np.sum(abs(y1_values - y2_values)) / 2
     return likeness
 
 # Cross-correlation is the coefficient of determination (R squared),
 # the simple linear regression between two PDPs or KDEs
 def r2(y1_values, y2_values):
+    _check_same_grid(y1_values, y2_values)
     correlation_matrix = np.corrcoef(y1_values, y2_values)
     correlation_xy = correlation_matrix[0, 1]
     cross_correlation = correlation_xy ** 2
@@ -44,3 +55,187 @@ def dis_likeness(y1_values, y2_values):
 
 def dis_r2(y1_values, y2_values):
     return float(1 - r2(y1_values, y2_values))
+
+# Pairwise matrix versions of the metrics above. Each takes an (n, G) array of curves on a shared grid,
+# and optionally a second (m, G) array, and returns the (n, m) matrix of the scalar metric between every
+# pair of rows (every row against itself when no second array is given).
+_BLOCK_BYTES = 64 * 2 ** 20
+
+def _as_curve_matrices(y_values, other_y_values):
+    y_values = np.atleast_2d(np.asarray(y_values, dtype=float))
+    if other_y_values is None:
+        return y_values, y_values, True
+    other_y_values = np.atleast_2d(np.asarray(other_y_values, dtype=float))
+    if y_values.shape[1] != other_y_values.shape[1]:
+        raise ValueError(
+            f"Curves must share a grid, got lengths {y_values.shape[1]} and {other_y_values.shape[1]}."
+        )
+    return y_values, other_y_values, False
+
+def _blocked_pairwise(y_values, other_y_values, reduce, block_size=None):
+    # Applies reduce(diff) -> (rows, cols) to blocks of the (rows, cols, G) difference array so that only
+    # one block is held in memory at a time. For a symmetric reduction of a matrix against itself, only the
+    # upper triangle of blocks is computed and then mirrored.
+    y1, y2, symmetric = _as_curve_matrices(y_values, other_y_values)
+    n, m, g = len(y1), len(y2), y1.shape[1]
+    if block_size is None:
+        block_size = _BLOCK_BYTES // (max(m, 1) * g * 8)
+    block_size = max(int(block_size), 1)
+    matrix = np.zeros((n, m))
+    for start in range(0, n, block_size):
+        stop = min(start + block_size, n)
+        col_start = start if symmetric else 0
+        diff = y1[start:stop, np.newaxis, :] - y2[np.newaxis, col_start:, :]
+        matrix[start:stop, col_start:] = reduce(diff)
+    if symmetric:
+        upper = np.triu(matrix)
+        matrix = upper + np.triu(upper, 1).T
+    return matrix
+
+def similarity_matrix(y_values, other_y_values=None):
+    y1, y2, symmetric = _as_curve_matrices(y_values, other_y_values)
+    root1 = np.sqrt(y1)
+    root2 = root1 if symmetric else np.sqrt(y2)
+    return root1 @ root2.T
+
+def likeness_matrix(y_values, other_y_values=None, block_size=None):
+    return 1 - _blocked_pairwise(
+        y_values, other_y_values, lambda diff: np.abs(diff).sum(axis=-1), block_size
+    ) / 2
+
+def r2_matrix(y_values, other_y_values=None):
+    y1, y2, symmetric = _as_curve_matrices(y_values, other_y_values)
+    centred1 = y1 - y1.mean(axis=1, keepdims=True)
+    centred2 = centred1 if symmetric else y2 - y2.mean(axis=1, keepdims=True)
+    gram = centred1 @ centred2.T
+    norms1 = np.sqrt(np.einsum('ij,ij->i', centred1, centred1))
+    norms2 = norms1 if symmetric else np.sqrt(np.einsum('ij,ij->i', centred2, centred2))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        correlation = gram / np.outer(norms1, norms2)
+    return correlation ** 2
+
+def ks_matrix(y_values, other_y_values=None, block_size=None):
+    return _blocked_pairwise(
+        y_values, other_y_values, lambda diff: np.abs(diff).max(axis=-1), block_size
+    )
+
+def kuiper_matrix(y_values, other_y_values=None, block_size=None):
+    return _blocked_pairwise(
+        y_values, other_y_values, lambda diff: diff.max(axis=-1) - diff.min(axis=-1), block_size
+    )
+
+def dis_similarity_matrix(y_values, other_y_values=None):
+    return 1 - similarity_matrix(y_values, other_y_values)
+
+def dis_likeness_matrix(y_values, other_y_values=None, block_size=None):
+    return 1 - likeness_matrix(y_values, other_y_values, block_size)
+
+def dis_r2_matrix(y_values, other_y_values=None):
+    return 1 - r2_matrix(y_values, other_y_values)
+
+def dis_ks_matrix(y_values, other_y_values=None, block_size=None):
+    return 1 - ks_matrix(y_values, other_y_values, block_size)
+
+def dis_kuiper_matrix(y_values, other_y_values=None, block_size=None):
+    return 1 - kuiper_matrix(y_values, other_y_values, block_size)
+
+# Exact two-sample KS and Kuiper statistics from raw ages, using the empirical CDFs (ECDFs) of the two
+# samples rather than CDF curves sampled on a grid.
+def _ecdf_difference(sorted_ages1, sorted_ages2):
+    # Merge walk over two sorted age arrays: a stable sort of the concatenation of two sorted runs is a
+    # linear-time merge. Returns ECDF1 - ECDF2 at every distinct age, taken after all tied ages.
+    n, m = len(sorted_ages1), len(sorted_ages2)
+    merged = np.concatenate([sorted_ages1, sorted_ages2])
+    order = np.argsort(merged, kind='stable')
+    steps = np.where(order < n, 1.0 / n, -1.0 / m)
+    differences = np.cumsum(steps)
+    merged = merged[order]
+    group_ends = np.append(merged[1:] != merged[:-1], True)
+    return differences[group_ends]
+
+def ks_ecdf(ages1, ages2):
+    differences = _ecdf_difference(np.sort(ages1), np.sort(ages2))
+    return float(np.max(np.abs(differences)))
+
+def kuiper_ecdf(ages1, ages2):
+    differences = _ecdf_difference(np.sort(ages1), np.sort(ages2))
+    return float(max(np.max(differences), 0) + max(-np.min(differences), 0))
+
+def _ecdf_pairwise(ages_list, other_ages_list, statistic):
+    # Each sample is sorted once; every pair is then a single merge walk.
+    sorted1 = [np.sort(np.asarray(ages, dtype=float)) for ages in ages_list]
+    symmetric = other_ages_list is None
+    sorted2 = sorted1 if symmetric else [np.sort(np.asarray(ages, dtype=float)) for ages in other_ages_list]
+    matrix = np.zeros((len(sorted1), len(sorted2)))
+    for i, ages1 in enumerate(sorted1):
+        for j in range(i + 1 if symmetric else 0, len(sorted2)):
+            matrix[i, j] = statistic(_ecdf_difference(ages1, sorted2[j]))
+            if symmetric:
+                matrix[j, i] = matrix[i, j]
+    return matrix
+
+def ks_ecdf_matrix(ages_list, other_ages_list=None):
+    return _ecdf_pairwise(ages_list, other_ages_list, lambda d: np.max(np.abs(d)))
+
+def kuiper_ecdf_matrix(ages_list, other_ages_list=None):
+    return _ecdf_pairwise(
+        ages_list, other_ages_list, lambda d: max(np.max(d), 0) + max(-np.min(d), 0)
+    )
+
+def dis_ks_ecdf_matrix(ages_list, other_ages_list=None):
+    return 1 - ks_ecdf_matrix(ages_list, other_ages_list)
+
+def dis_kuiper_ecdf_matrix(ages_list, other_ages_list=None):
+    return 1 - kuiper_ecdf_matrix(ages_list, other_ages_list)
+
+# Metrics between sparse distributions (anything with x_values, offset and values, such as
+# distributions.SparseDistribution). Only the overlap of the two supports is visited; everything
+# outside it is known to be zero in at least one of the curves.
+def _overlap(sparse1, sparse2):
+    if len(sparse1.x_values) != len(sparse2.x_values):
+        raise ValueError(
+            f"Curves must be on the same grid, got lengths {len(sparse1.x_values)} and {len(sparse2.x_values)}."
+        )
+    start = max(sparse1.offset, sparse2.offset)
+    stop = min(sparse1.offset + len(sparse1.values), sparse2.offset + len(sparse2.values))
+    if stop <= start:
+        return np.empty(0), np.empty(0)
+    return (sparse1.values[start - sparse1.offset:stop - sparse1.offset],
+            sparse2.values[start - sparse2.offset:stop - sparse2.offset])
+
+def sparse_similarity(sparse1, sparse2):
+    values1, values2 = _overlap(sparse1, sparse2)
+    return np.sum(np.sqrt(values1 * values2))
+
+# |a - b| = a + b - 2 min(a, b), so only the overlap needs visiting beyond the two totals
+def sparse_likeness(sparse1, sparse2):
+    values1, values2 = _overlap(sparse1, sparse2)
+    mismatch = np.sum(sparse1.values) + np.sum(sparse2.values) - 2 * np.sum(np.minimum(values1, values2))
+    return 1 - mismatch / 2
+
+# Pearson correlation over the full grid from the per-curve sums and the overlap's cross product
+def sparse_r2(sparse1, sparse2):
+    values1, values2 = _overlap(sparse1, sparse2)
+    n = len(sparse1.x_values)
+    sum1, sum2 = np.sum(sparse1.values), np.sum(sparse2.values)
+    covariance = np.dot(values1, values2) - sum1 * sum2 / n
+    variance1 = np.dot(sparse1.values, sparse1.values) - sum1 ** 2 / n
+    variance2 = np.dot(sparse2.values, sparse2.values) - sum2 ** 2 / n
+    return covariance ** 2 / (variance1 * variance2)
+
+def sparse_similarity_matrix(sparse_distributions):
+    return _sparse_pairwise(sparse_distributions, sparse_similarity)
+
+def sparse_likeness_matrix(sparse_distributions):
+    return _sparse_pairwise(sparse_distributions, sparse_likeness)
+
+def sparse_r2_matrix(sparse_distributions):
+    return _sparse_pairwise(sparse_distributions, sparse_r2)
+
+def _sparse_pairwise(sparse_distributions, metric):
+    n = len(sparse_distributions)
+    matrix = np.zeros((n, n))
+    for i in range(n):
+        for j in range(i, n):
+            matrix[i, j] = matrix[j, i] = metric(sparse_distributions[i], sparse_distributions[j])
+    return matrix
@@ -1,11 +1,17 @@
 import numpy as np
 import pandas as pd
 from dz_lib.univariate import metrics
-from dz_lib.univariate.distributions import Distribution, distribution_graph
+from dz_lib.univariate.data import Sample
+from dz_lib.univariate.distributions import Distribution, check_grids, distribution_graph, distribution_set
 from dz_lib.utils import fonts
+from dz_lib.utils.parallel import resolve_n_jobs
 import random
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
 from matplotlib import pyplot as plt
 from matplotlib.colors import ListedColormap
+from scipy import sparse
+from scipy.optimize import linprog, nnls
 
 
 class Contribution:
@@ -14,38 +20,32 @@ class Contribution:
         self.contribution = contribution
         self.standard_deviation = standard_deviation
 
-def monte_carlo_model(sink_distribution: Distribution, source_distributions: [Distribution], n_trials: int=10000, metric: str="cross_correlation"):
-    sink_y_values = sink_distribution.y_values
-    sources_y_values = [dist.y_values for dist in source_distributions]
-    trials = [create_trial((sink_y_values, sources_y_values, metric)) for _ in range(n_trials)]
-    if metric == "cross_correlation":
-        sorted_trials = sorted(trials, key=lambda x: x.test_val, reverse=True)
-    elif metric == "ks" or metric == "kuiper":
-        sorted_trials = sorted(trials, key=lambda x: x.test_val, reverse=False)
-    else:
-        raise ValueError(f"Unknown metric '{metric}'")
-    top_trials = sorted_trials[:10]
-    top_lines = [trial.model_line for trial in top_trials]
-    
-    # Convert top lines back to Distribution objects
-    x_values = sink_distribution.x_values
-    top_distributions = [Distribution(f"Top_Trial_{i+1}", x_values, y_values) 
-                        for i, y_values in enumerate(top_lines)]
-    
-    random_configurations = [trial.random_configuration for trial in top_trials]
-    source_contributions = np.average(random_configurations, axis=0) * 100
-    source_std = np.std(random_configurations, axis=0) * 100
-    return source_contributions, source_std, top_distributions
+def monte_carlo_model(sink_distribution: Distribution, source_distributions: [Distribution], n_trials: int=10000, metric: str="cross_correlation", seed=None, n_jobs: int=1):
+    """
+    Random-search unmixing: the mean and standard deviation (in percent) of
+    the source weights of the 10 best of n_trials random mixtures, and those
+    mixtures as distributions. Weights are drawn uniformly on the simplex by
+    vectorized_monte_carlo_model; pass a seed for reproducible results and
+    n_jobs to spread the trials across processes. UnmixingTrial and
+    create_trial are kept for callers that build trials themselves.
+    """
+    return vectorized_monte_carlo_model(
+        sink_distribution, source_distributions, n_trials=n_trials, metric=metric, seed=seed, n_jobs=n_jobs
+    )
 
 def create_trial(args):
-    sink_y_values, sources_y_values, test_type = args
-    return UnmixingTrial(sink_y_values, sources_y_values, metric=test_type)
+    sink_y_values, sources_y_values, test_type, *cdfs = args
+    return UnmixingTrial(sink_y_values, sources_y_values, test_type, *cdfs)
 
 class UnmixingTrial:
-    def __init__(self, sink_line: [float], source_lines: [[float]], metric: str="cross_correlation"):
+    def __init__(self, sink_line: [float], source_lines: [[float]], metric: str="cross_correlation",
+                 sink_cdf: [float]=None, source_cdfs: [[float]]=None):
         self.sink_line = sink_line
         self.source_lines = source_lines
         self.metric = metric
+        # Optional precomputed CDFs for ks/kuiper; computed from the lines if not given
+        self.sink_cdf = sink_cdf
+        self.source_cdfs = source_cdfs
         self.random_configuration, self.model_line, self.test_val = self.__do_trial()
 
     def __do_trial(self):
@@ -59,13 +59,19 @@ class UnmixingTrial:
         if self.metric == "cross_correlation":
             val = metrics.r2(sink_line, model_line)
         elif self.metric == "ks":
-            val = metrics.ks(sink_line, model_line)
+            val = metrics.ks(*self.__cdfs(model_line, rands))
         elif self.metric == "kuiper":
-            val = metrics.kuiper(sink_line, model_line)
+            val = metrics.kuiper(*self.__cdfs(model_line, rands))
         else:
             raise ValueError(f"Unknown metric '{self.metric}'")
         return rands, model_line, val
 
+    def __cdfs(self, model_line, rands):
+        sink_cdf = _cdf_lines(self.sink_line) if self.sink_cdf is None else self.sink_cdf
+        if self.source_cdfs is None:
+            return sink_cdf, _cdf_lines(model_line)
+        return sink_cdf, np.dot(rands, self.source_cdfs)
+
     @staticmethod
     def __make_cumulative_random(num_samples):
         rands = [random.random() for _ in range(num_samples)]
@@ -74,6 +80,509 @@ class UnmixingTrial:
         return normalized_rands
 
 
+def vectorized_monte_carlo_model(
+        sink_distribution: Distribution,
+        source_distributions: [Distribution],
+        n_trials: int = 10000,
+        metric: str = "cross_correlation",
+        n_top: int = 10,
+        batch_size: int = 1000,
+        seed=None,
+        n_jobs: int = 1,
+):
+    """
+    Batched equivalent of monte_carlo_model.
+
+    Trials are drawn in batches as a (batch_size, n_sources) matrix of weights
+    from a flat Dirichlet distribution (uniform on the simplex). Each batch has
+    its own numpy Generator, spawned from SeedSequence(seed), so a given seed
+    gives identical results whatever n_jobs is. Cross-correlation trials are
+    scored in closed form from the source Gram matrix; KS and Kuiper trials
+    are scored on CDFs, the mix of precomputed source CDFs being formed with
+    a single matrix product per batch. Only the running best n_top trials are
+    kept, so memory is bounded by batch_size and n_top rather than n_trials,
+    and only those are turned into curves.
+
+    With n_jobs > 1 (or -1 for one worker per CPU) the batches are spread
+    across a process pool; the sink and source curves are placed in shared
+    memory once rather than pickled for every task. Returns the same
+    (contributions, standard deviations, top distributions) as
+    monte_carlo_model.
+    """
+    return batch_monte_carlo_model(
+        [sink_distribution], source_distributions, n_trials=n_trials, metric=metric,
+        n_top=n_top, batch_size=batch_size, seed=seed, n_jobs=n_jobs,
+    )[0]
+
+
+def batch_monte_carlo_model(
+        sink_distributions: [Distribution],
+        source_distributions: [Distribution],
+        n_trials: int = 10000,
+        metric: str = "cross_correlation",
+        n_top: int = 10,
+        batch_size: int = 1000,
+        seed=None,
+        n_jobs: int = 1,
+):
+    """
+    Unmix several sinks against the same sources in one pass.
+
+    Every batch of candidate weights is drawn once and scored against all
+    sinks together: for cross-correlation this is a single (batch, k) x
+    (k, n_sinks) product with the source-sink Gram block, and for KS and
+    Kuiper each batch's model CDFs are built once and reused for every
+    sink. A separate top n_top is kept per sink. Seeding and n_jobs behave
+    as in vectorized_monte_carlo_model, and a sink's result does not depend
+    on which other sinks it is batched with.
+
+    Returns a list with one (contributions, standard deviations, top
+    distributions) tuple per sink, in the order given.
+    """
+    sink_distributions = list(sink_distributions)
+    check_grids(sink_distributions + list(source_distributions))
+    sink_lines = np.vstack([dist.y_values for dist in sink_distributions]).astype(float)
+    source_lines = np.vstack([dist.y_values for dist in source_distributions]).astype(float)
+    batch_sizes = [min(batch_size, n_trials - start) for start in range(0, n_trials, batch_size)]
+    batch_seeds = np.random.SeedSequence(seed).spawn(len(batch_sizes))
+    batches = list(zip(batch_seeds, batch_sizes))
+
+    n_jobs = resolve_n_jobs(n_jobs)
+    if n_jobs == 1:
+        scorer = _make_scorer(sink_lines, source_lines, metric)
+        top_trials = _run_trial_batches(scorer, len(source_lines), batches, n_top)
+    else:
+        top_trials = _run_trial_batches_in_pool(sink_lines, source_lines, metric, batches, n_top, n_jobs)
+    return [
+        _summarize_top_trials(sink_top.weights, source_lines, sink.x_values, sink.grid)
+        for sink, sink_top in zip(sink_distributions, top_trials)
+    ]
+
+
+class ConvergenceTrace:
+    """
+    Record of a streaming unmixing run: the top-k contribution mean and
+    standard deviation (in percent) after every batch, and the largest change
+    in either from the previous batch.
+    """
+    def __init__(self, n_trials: int, converged: bool, contributions, standard_deviations, changes):
+        self.n_trials = n_trials
+        self.converged = converged
+        self.contributions = contributions
+        self.standard_deviations = standard_deviations
+        self.changes = changes
+
+
+def streaming_monte_carlo_model(
+        sink_distribution: Distribution,
+        source_distributions: [Distribution],
+        metric: str = "cross_correlation",
+        n_top: int = 10,
+        batch_size: int = 1000,
+        max_trials: int = 100000,
+        min_trials: int = 2000,
+        tolerance: float = 0.5,
+        patience: int = 3,
+        seed=None,
+):
+    """
+    Run unmixing trials batch by batch until the answer settles.
+
+    After each batch the mean and standard deviation of the top n_top trials'
+    weights are recomputed. Once neither has moved by more than tolerance
+    percentage points for patience consecutive batches (and at least
+    min_trials have run) the run stops; otherwise it stops at max_trials.
+    Batches are seeded exactly as in vectorized_monte_carlo_model, so a run
+    that stops after n trials returns what vectorized_monte_carlo_model gives
+    for n_trials=n with the same seed.
+
+    Returns (contributions, standard deviations, top distributions,
+    ConvergenceTrace).
+    """
+    check_grids([sink_distribution] + list(source_distributions))
+    sink_line = np.asarray(sink_distribution.y_values, dtype=float)
+    source_lines = np.vstack([dist.y_values for dist in source_distributions]).astype(float)
+    scorer = _make_scorer(sink_line, source_lines, metric)
+    seed_sequence = np.random.SeedSequence(seed)
+    top_trials = _TopTrials(n_top)
+    contribution_trace, std_trace, changes = [], [], []
+    n_trials, n_stable = 0, 0
+    while n_trials < max_trials and n_stable < patience:
+        n_batch = min(batch_size, max_trials - n_trials)
+        rng = np.random.default_rng(seed_sequence.spawn(1)[0])
+        weights = rng.dirichlet(np.ones(len(source_lines)), size=n_batch)
+        top_trials.update(scorer.losses(weights)[:, 0], weights)
+        n_trials += n_batch
+
+        contribution_trace.append(np.average(top_trials.weights, axis=0) * 100)
+        std_trace.append(np.std(top_trials.weights, axis=0) * 100)
+        if len(contribution_trace) > 1:
+            change = max(np.abs(contribution_trace[-1] - contribution_trace[-2]).max(),
+                         np.abs(std_trace[-1] - std_trace[-2]).max())
+        else:
+            change = np.inf
+        changes.append(change)
+        stable = change < tolerance and len(top_trials.losses) == n_top
+        n_stable = n_stable + 1 if stable and n_trials >= min_trials else 0
+
+    trace = ConvergenceTrace(
+        n_trials=n_trials,
+        converged=n_stable >= patience,
+        contributions=np.array(contribution_trace),
+        standard_deviations=np.array(std_trace),
+        changes=np.array(changes),
+    )
+    contributions, standard_deviations, top_distributions = _summarize_top_trials(
+        top_trials.weights, source_lines, sink_distribution.x_values, sink_distribution.grid
+    )
+    return contributions, standard_deviations, top_distributions, trace
+
+
+def optimized_model(
+        sink_distribution: Distribution,
+        source_distributions: [Distribution],
+        metric: str = "cross_correlation",
+        sink_sample: Sample = None,
+        function_type: str = "kde",
+        bandwidth: float = 10,
+        method: str = None,
+        n_bootstrap: int = 100,
+        seed=None,
+):
+    """
+    Deterministic unmixing: solve directly for the best source weights on the
+    simplex instead of searching at random.
+
+    For cross_correlation the centred sink curve is projected onto the cone
+    of centred source curves with non-negative least squares (which maximises
+    R^2 over non-negative weights) and the weights are then normalised to sum
+    to 1. For ks and kuiper the minimax fit of the mixed CDF to the sink CDF
+    over the simplex is solved exactly as a small linear program.
+
+    If sink_sample is given, its grains are resampled with replacement
+    n_bootstrap times, the resampled sinks are rebuilt in one distribution_set
+    call on the sink's grid, and the standard deviation of the refitted
+    weights is reported. method defaults to the batched FFT engine for KDEs
+    and the truncated engine for PDPs. Without sink_sample the standard
+    deviations are 0.
+
+    Cost: a cross_correlation fit takes well under a millisecond. A ks or
+    kuiper fit takes some 10-20 ms; bootstrap refits are solved together
+    (see _MinimaxSolver) at a few ms each, so the default 100 resamples
+    add roughly half a second for five sources.
+
+    Returns a list of Contribution objects (in percent), one per source.
+    """
+    check_grids([sink_distribution] + list(source_distributions))
+    sink_line = np.asarray(sink_distribution.y_values, dtype=float)
+    source_lines = np.vstack([dist.y_values for dist in source_distributions]).astype(float)
+    solve = _make_simplex_solver(source_lines, metric)
+    weights = solve(sink_line)
+
+    if sink_sample is not None and n_bootstrap > 0:
+        rng = np.random.default_rng(seed)
+        n_grains = len(sink_sample)
+        resampled = rng.integers(n_grains, size=(n_bootstrap, n_grains))
+        bootstrap_samples = [
+            Sample.from_arrays(f"{sink_sample.name}_{i}", sink_sample.ages[indices], sink_sample.uncertainties[indices])
+            for i, indices in enumerate(resampled)
+        ]
+        if method is None:
+            method = "fft" if function_type == "kde" else "truncated"
+        bootstrap_sinks = distribution_set(
+            bootstrap_samples, function_type=function_type, bandwidth=bandwidth,
+            method=method, grid=sink_distribution.grid,
+        )
+        if isinstance(solve, _MinimaxSolver):
+            bootstrap_weights = solve.solve_many(bootstrap_sinks.y_values)
+        else:
+            bootstrap_weights = np.array([solve(line) for line in bootstrap_sinks.y_values])
+        standard_deviations = np.std(bootstrap_weights, axis=0) * 100
+    else:
+        standard_deviations = np.zeros(len(source_lines))
+
+    return [
+        Contribution(source.name, contribution, standard_deviation)
+        for source, contribution, standard_deviation in zip(source_distributions, weights * 100, standard_deviations)
+    ]
+
+
+def _make_simplex_solver(source_lines, metric):
+    # Returns a function mapping a sink curve to the best weights on the simplex
+    if metric == "cross_correlation":
+        centred_sources = (source_lines - source_lines.mean(axis=1, keepdims=True)).T
+
+        def solve(sink_line):
+            weights, _ = nnls(centred_sources, sink_line - sink_line.mean())
+            if weights.sum() == 0:
+                # The sink is anti-correlated with every source; fall back to an even mix
+                return np.full(len(source_lines), 1 / len(source_lines))
+            return weights / weights.sum()
+        return solve
+    if metric == "ks" or metric == "kuiper":
+        return _MinimaxSolver(source_lines, metric)
+    raise ValueError(f"Unknown metric '{metric}'")
+
+
+class _MinimaxSolver:
+    """
+    Weights on the simplex minimising max|sink - model| (ks) or
+    max(sink - model) + max(model - sink) (kuiper) between CDFs.
+
+    This is a linear program in the k weights plus one (ks) or two (kuiper)
+    bound variables, with two constraints per grid point. Only a few grid
+    points ever bind, so it is solved by cutting planes: the LP is solved on
+    a small set of points, the fit is checked on the full grid, the worst
+    local misfits beyond the LP's bounds are added and the LP re-solved,
+    until no point is off by more than tol. solve_many fits many sinks
+    (e.g. bootstrap resamples) together, as one block-diagonal LP per round,
+    each starting from the points active in the first solve.
+    """
+
+    def __init__(self, source_lines, metric, n_initial_rows: int = 64, tol: float = 1e-9):
+        self.source_cdfs = _cdf_lines(source_lines)
+        self.metric = metric
+        self.tol = tol
+        varying = np.flatnonzero(((self.source_cdfs > tol) & (self.source_cdfs < 1 - tol)).any(axis=0))
+        if len(varying) == 0:
+            varying = np.arange(self.source_cdfs.shape[1])
+        self.initial_rows = np.unique(np.linspace(varying[0], varying[-1], n_initial_rows).astype(int))
+        self.warm_rows = None
+
+    def __call__(self, sink_line):
+        return self.solve_many(np.atleast_2d(sink_line))[0]
+
+    def solve_many(self, sink_lines):
+        sink_cdfs = _cdf_lines(np.asarray(sink_lines, dtype=float))
+        start_rows = self.initial_rows if self.warm_rows is None else self.warm_rows
+        rows = [start_rows] * len(sink_cdfs)
+        weights = np.zeros((len(sink_cdfs), len(self.source_cdfs)))
+        active = list(range(len(sink_cdfs)))
+        while active:
+            solutions = _minimax_simplex_weights(
+                [sink_cdfs[i, rows[i]] for i in active],
+                [self.source_cdfs[:, rows[i]] for i in active],
+                self.metric,
+            )
+            still_active = []
+            for i, (sink_weights, upper, lower) in zip(active, solutions):
+                weights[i] = sink_weights
+                new_rows = self._violated_rows(sink_cdfs[i] - sink_weights @ self.source_cdfs, upper, lower)
+                new_rows = np.setdiff1d(new_rows, rows[i])
+                if len(new_rows):
+                    rows[i] = np.union1d(rows[i], new_rows)
+                    still_active.append(i)
+            active = still_active
+        if self.warm_rows is None:
+            self.warm_rows = rows[0]
+        return weights
+
+    def _violated_rows(self, differences, upper, lower, n_rows: int = 8):
+        # local extrema of the misfit that exceed the LP's bounds, worst first
+        peaks = np.r_[True, differences[1:] >= differences[:-1]] & np.r_[differences[:-1] >= differences[1:], True]
+        troughs = np.r_[True, differences[1:] <= differences[:-1]] & np.r_[differences[:-1] <= differences[1:], True]
+        over = np.flatnonzero(peaks & (differences > upper + self.tol))
+        under = np.flatnonzero(troughs & (-differences > lower + self.tol))
+        return np.concatenate([
+            over[np.argsort(-differences[over])[:n_rows]],
+            under[np.argsort(differences[under])[:n_rows]],
+        ])
+
+
+def _minimax_simplex_weights(sink_lines, source_lines, metric):
+    """
+    Solve independent minimax LPs, one per (sink points, source points)
+    pair, as a single block-diagonal LP. Returns a (weights, upper, lower)
+    tuple per problem, where upper and lower bound sink - model and
+    model - sink (equal for ks).
+    """
+    n_sources = len(source_lines[0])
+    n_bounds = 1 if metric == "ks" else 2
+    n_variables = n_sources + n_bounds
+    inequality_blocks, inequality_bounds = [], []
+    for sink_line, block_sources in zip(sink_lines, source_lines):
+        n_points = len(sink_line)
+        models = block_sources.T
+        upper = np.ones((n_points, 1))
+        lower = np.ones((n_points, 1)) if metric == "ks" else np.zeros((n_points, 1))
+        above = np.hstack([-models, -upper] + ([] if metric == "ks" else [np.zeros((n_points, 1))]))
+        below = np.hstack([models, -lower] + ([] if metric == "ks" else [-np.ones((n_points, 1))]))
+        # sink - model <= upper bound and model - sink <= lower bound (the same bound for ks)
+        inequality_blocks.append(np.vstack([above, below]))
+        inequality_bounds.append(np.concatenate([-sink_line, sink_line]))
+    n_problems = len(sink_lines)
+    simplex_row = np.concatenate([np.ones(n_sources), np.zeros(n_bounds)])[None, :]
+    result = linprog(
+        c=np.tile(np.concatenate([np.zeros(n_sources), np.ones(n_bounds)]), n_problems),
+        A_ub=sparse.block_diag(inequality_blocks, format="csr"),
+        b_ub=np.concatenate(inequality_bounds),
+        A_eq=sparse.block_diag([simplex_row] * n_problems, format="csr"),
+        b_eq=np.ones(n_problems),
+        bounds=([(0, None)] * n_sources + [(None, None)] * n_bounds) * n_problems,
+        method="highs",
+        options={"presolve": False},
+    )
+    if not result.success:
+        raise RuntimeError(f"Simplex unmixing failed: {result.message}")
+    solutions = []
+    for x in result.x.reshape(n_problems, n_variables):
+        weights = np.clip(x[:n_sources], 0, None)
+        solutions.append((weights / weights.sum(), x[n_sources], x[-1]))
+    return solutions
+
+
+def _run_trial_batches(scorer, n_sources: int, batches, n_top: int):
+    # batches is a list of (SeedSequence, number of trials) pairs; returns one _TopTrials per sink
+    top_trials = [_TopTrials(n_top) for _ in range(scorer.n_sinks)]
+    for batch_seed, n_batch in batches:
+        rng = np.random.default_rng(batch_seed)
+        weights = rng.dirichlet(np.ones(n_sources), size=n_batch)
+        losses = scorer.losses(weights)
+        for i, sink_top in enumerate(top_trials):
+            sink_top.update(losses[:, i], weights)
+    return top_trials
+
+
+_worker_state = {}
+
+
+def _init_trial_worker(shared_name, shape, n_sources, metric):
+    shared = shared_memory.SharedMemory(name=shared_name)
+    curves = np.ndarray(shape, dtype=float, buffer=shared.buf)
+    _worker_state["shared"] = shared
+    _worker_state["n_sources"] = n_sources
+    _worker_state["scorer"] = _make_scorer(curves[n_sources:], curves[:n_sources], metric)
+
+
+def _trial_worker(batches, n_top):
+    top_trials = _run_trial_batches(_worker_state["scorer"], _worker_state["n_sources"], batches, n_top)
+    return [(sink_top.losses, sink_top.weights) for sink_top in top_trials]
+
+
+def _run_trial_batches_in_pool(sink_lines, source_lines, metric, batches, n_top, n_jobs):
+    _make_scorer(sink_lines, source_lines, metric)  # fail fast on an unknown metric
+    curves = np.vstack([source_lines, sink_lines])
+    shared = shared_memory.SharedMemory(create=True, size=curves.nbytes)
+    try:
+        np.ndarray(curves.shape, dtype=float, buffer=shared.buf)[:] = curves
+        n_tasks = min(len(batches), 4 * n_jobs)
+        bounds = np.linspace(0, len(batches), n_tasks + 1).astype(int)
+        top_trials = [_TopTrials(n_top) for _ in range(len(sink_lines))]
+        with ProcessPoolExecutor(
+                max_workers=n_jobs,
+                initializer=_init_trial_worker,
+                initargs=(shared.name, curves.shape, len(source_lines), metric),
+        ) as executor:
+            futures = [
+                executor.submit(_trial_worker, batches[start:stop], n_top)
+                for start, stop in zip(bounds[:-1], bounds[1:])
+            ]
+            for future in futures:
+                for sink_top, (losses, weights) in zip(top_trials, future.result()):
+                    sink_top.update(losses, weights)
+    finally:
+        shared.close()
+        shared.unlink()
+    return top_trials
+
+
+class _TopTrials:
+    """Running best n_top trials across batches, ranked by ascending loss."""
+
+    def __init__(self, n_top: int):
+        self.n_top = n_top
+        self.losses = np.empty(0)
+        self.weights = None
+
+    def update(self, losses, weights):
+        if self.weights is not None:
+            losses = np.concatenate([self.losses, losses])
+            weights = np.concatenate([self.weights, weights])
+        if len(losses) > self.n_top:
+            keep = np.argpartition(losses, self.n_top - 1)[:self.n_top]
+            losses, weights = losses[keep], weights[keep]
+        order = np.argsort(losses, kind='stable')
+        self.losses, self.weights = losses[order], weights[order]
+
+
+class _GramScorer:
+    """
+    Closed-form cross-correlation (R^2) scorer. The R^2 between a sink and
+    any weighted mix of the sources only depends on the inner products of the
+    centred source and sink curves, so their Gram matrix is computed once and
+    each trial is then scored in O(k^2) without forming its model curve.
+    """
+
+    def __init__(self, sink_lines, source_lines):
+        n_sources = len(source_lines)
+        curves = np.vstack([source_lines, sink_lines])
+        centred = curves - curves.mean(axis=1, keepdims=True)
+        gram = centred @ centred.T
+        self.n_sinks = len(curves) - n_sources
+        self.source_gram = gram[:n_sources, :n_sources]
+        self.source_sink = gram[:n_sources, n_sources:]
+        self.sink_norms = np.diag(gram)[n_sources:]
+
+    def r2(self, weights):
+        """(n_trials, n_sinks) R^2 of each weighted mix against each sink."""
+        covariances = weights @ self.source_sink
+        model_norms = np.einsum('ij,jk,ik->i', weights, self.source_gram, weights)
+        return covariances ** 2 / (model_norms[:, None] * self.sink_norms)
+
+    def losses(self, weights):
+        return -self.r2(weights)
+
+
+class _CdfScorer:
+    """
+    KS / Kuiper scorer in CDF space. CDFs are linear in the weights, so the
+    CDF of a mix is the same weighted mix of the source CDFs: these are
+    computed once, and each batch is scored with one matmul and a row-wise
+    max reduction.
+    """
+
+    def __init__(self, sink_lines, source_lines, metric):
+        self.sink_cdfs = _cdf_lines(sink_lines)
+        self.source_cdfs = _cdf_lines(source_lines)
+        self.metric = metric
+        self.n_sinks = len(sink_lines)
+
+    def losses(self, weights):
+        model_cdfs = weights @ self.source_cdfs
+        losses = np.empty((len(weights), self.n_sinks))
+        for i, sink_cdf in enumerate(self.sink_cdfs):
+            differences = sink_cdf - model_cdfs
+            if self.metric == "ks":
+                losses[:, i] = np.abs(differences).max(axis=1)
+            else:
+                losses[:, i] = differences.max(axis=1) - differences.min(axis=1)
+        return losses
+
+
+def _cdf_lines(lines):
+    cdfs = np.cumsum(lines, axis=-1)
+    return cdfs / cdfs[..., -1:]
+
+
+def _make_scorer(sink_lines, source_lines, metric):
+    # Scorers return (n_trials, n_sinks) losses: lower is always better.
+    sink_lines = np.atleast_2d(sink_lines)
+    if metric == "cross_correlation":
+        return _GramScorer(sink_lines, source_lines)
+    if metric == "ks" or metric == "kuiper":
+        return _CdfScorer(sink_lines, source_lines, metric)
+    raise ValueError(f"Unknown metric '{metric}'")
+
+
+def _summarize_top_trials(top_weights, source_lines, x_values, grid=None):
+    top_lines = top_weights @ source_lines
+    top_distributions = [Distribution(f"Top_Trial_{i+1}", x_values, y_values, grid=grid)
+                         for i, y_values in enumerate(top_lines)]
+    source_contributions = np.average(top_weights, axis=0) * 100
+    source_std = np.std(top_weights, axis=0) * 100
+    return source_contributions, source_std, top_distributions
+
+
 def relative_contribution_graph(
         contributions: [Contribution],
         title: str = "Relative Contribution Graph",
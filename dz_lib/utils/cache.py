@@ -0,0 +1,82 @@
+from collections import OrderedDict
+import hashlib
+import os
+import numpy as np
+
+
+class DistributionCache:
+    """
+    Content-addressed cache of computed distribution curves.
+
+    Entries are keyed by a hash of the sample's grain arrays plus the
+    parameters that produced the curve (see make_key). The in-memory tier
+    evicts least recently used entries once their total size exceeds
+    max_bytes. If cache_dir is given, every entry is also written there as
+    a .npy file, which survives process restarts and is consulted on a
+    memory miss.
+    """
+
+    def __init__(self, max_bytes: int = 256 * 2 ** 20, cache_dir: str = None):
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self.hits = 0
+        self.misses = 0
+        self.current_bytes = 0
+        self._entries = OrderedDict()
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(*parts) -> str:
+        return hashlib.sha1(repr(parts).encode("utf-8")).hexdigest()
+
+    def get(self, key: str):
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return self._entries[key].copy()
+        path = self._path(key)
+        if path is not None and os.path.exists(path):
+            values = np.load(path)
+            self._store(key, values)
+            self.hits += 1
+            return values.copy()
+        self.misses += 1
+        return None
+
+    def put(self, key: str, values: np.ndarray):
+        values = np.array(values, dtype=float)
+        self._store(key, values)
+        path = self._path(key)
+        if path is not None:
+            np.save(path, values)
+
+    def clear(self, disk: bool = False):
+        self._entries.clear()
+        self.current_bytes = 0
+        if disk and self.cache_dir is not None:
+            for file_name in os.listdir(self.cache_dir):
+                if file_name.endswith(".npy"):
+                    os.remove(os.path.join(self.cache_dir, file_name))
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key: str):
+        return key in self._entries
+
+    def _store(self, key: str, values: np.ndarray):
+        if key in self._entries:
+            self.current_bytes -= self._entries.pop(key).nbytes
+        if values.nbytes > self.max_bytes:
+            return
+        self._entries[key] = values
+        self.current_bytes += values.nbytes
+        while self.current_bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.current_bytes -= evicted.nbytes
+
+    def _path(self, key: str):
+        if self.cache_dir is None:
+            return None
+        return os.path.join(self.cache_dir, f"{key}.npy")
@@ -1,6 +1,7 @@
 import dz_lib.bivariate.data as two_d
 import dz_lib.univariate.data  as one_d
 import openpyxl
+import numpy as np
 
 
 def excel_to_array(file_path):
@@ -30,7 +31,8 @@ def read_1d_samples(spreadsheet_array, max_age: int=4500):
     for i in range(0, num_cols, 2):
         sample_name = str(spreadsheet_array[0][i])
         if sample_name is not None:
-            grains = []
+            ages = []
+            uncertainties = []
             for row_data in spreadsheet_array[1:]:
                 if i < len(row_data):
                     age = row_data[i]
@@ -39,10 +41,11 @@ def read_1d_samples(spreadsheet_array, max_age: int=4500):
                     if (isinstance(age, (float, int)) and 
                         isinstance(uncertainty, (float, int)) and 
                         float(age) < max_age):
-                        grains.append(one_d.Grain(float(age), float(uncertainty)))
+                        ages.append(float(age))
+                        uncertainties.append(float(uncertainty))
             
-            if grains:
-                sample = one_d.Sample(sample_name, grains)
+            if ages:
+                sample = one_d.Sample.from_arrays(sample_name, ages, uncertainties)
                 samples.append(sample)
     return samples
 
@@ -69,16 +72,14 @@ def read_2d_samples(spreadsheet_array, max_age: int=4500):
 def get_x_max(samples):
     x_max = 0
     for sample in samples:
-        for grain in sample.grains:
-            if grain.age + grain.uncertainty > x_max:
-                x_max = grain.age + grain.uncertainty
+        if len(sample.ages):
+            x_max = max(x_max, np.max(sample.ages + sample.uncertainties))
     return x_max
 
 
 def get_x_min(samples):
     x_min = 0
     for sample in samples:
-        for grain in sample.grains:
-            if grain.age - grain.uncertainty < x_min:
-                x_min = grain.age - grain.uncertainty
-    return x_min
\ No newline at end of file
+        if len(sample.ages):
+            x_min = min(x_min, np.min(sample.ages - sample.uncertainties))
+    return x_min
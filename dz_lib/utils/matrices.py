@@ -3,69 +3,128 @@ from io import BytesIO
 import pyexcel as p
 import numpy as np
 import pandas as pd
-from dz_lib.univariate.distributions import kde_function, pdp_function, cdf_function
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from dz_lib.univariate.distributions import distribution_set, cdf_function, analytic_cdf_function
 from dz_lib.univariate import metrics
+from dz_lib.utils.parallel import resolve_n_jobs
 
-def generate_data_frame(samples, row_labels=None, col_labels=None, metric="similarity", function_type="kde"):
+# metric name -> (pairwise kernel, curve type it compares)
+_METRIC_KERNELS = {
+    "similarity": (metrics.similarity_matrix, "density"),
+    "dis_similarity": (metrics.dis_similarity_matrix, "density"),
+    "likeness": (metrics.likeness_matrix, "density"),
+    "dis_likeness": (metrics.dis_likeness_matrix, "density"),
+    "cross_correlation": (metrics.r2_matrix, "density"),
+    "dis_cross_correlation": (metrics.dis_r2_matrix, "density"),
+    "ks": (metrics.ks_matrix, "cdf"),
+    "dis_ks": (metrics.dis_ks_matrix, "cdf"),
+    "kuiper": (metrics.kuiper_matrix, "cdf"),
+    "dis_kuiper": (metrics.dis_kuiper_matrix, "cdf"),
+}
+
+# KS/Kuiper metric name -> exact two-sample kernel on raw ages
+_ECDF_KERNELS = {
+    "ks": metrics.ks_ecdf_matrix,
+    "dis_ks": metrics.dis_ks_ecdf_matrix,
+    "kuiper": metrics.kuiper_ecdf_matrix,
+    "dis_kuiper": metrics.dis_kuiper_ecdf_matrix,
+}
+
+
+def generate_matrix(
+        samples,
+        metric="similarity",
+        function_type="kde",
+        n_jobs=1,
+        parallel="thread",
+        block_size=None,
+        cdf_method="cumsum",
+):
+    """
+    Full-precision (n, n) matrix of `metric` between every pair of samples.
+
+    Only the curves the metric needs are built, once: KDEs or PDPs (per
+    function_type) for the density metrics, CDFs of 10 Ma KDEs for KS and
+    Kuiper. All metrics are symmetric, so only the upper triangle is
+    computed. With n_jobs > 1 (or -1 for one worker per CPU) the upper
+    triangle is split into blocks of `block_size` rows and columns, which are
+    computed on a thread pool (parallel="thread") or process pool
+    (parallel="process").
+
+    cdf_method chooses how KS and Kuiper CDFs are formed: "cumsum" sums the
+    discretised KDE, "analytic" evaluates the KDE's CDF exactly from the
+    grain ages (analytic_cdf_function), and "ecdf" gives the exact
+    two-sample statistics of the samples' empirical CDFs, computed from
+    sorted grain ages without building any curves.
+    """
+    if metric not in _METRIC_KERNELS:
+        raise ValueError(f"Unknown metric {metric}")
+    kernel, curve_type = _METRIC_KERNELS[metric]
+    if curve_type == "cdf" and cdf_method == "ecdf":
+        kernel = _ECDF_KERNELS[metric]
+        curves = [sample.ages for sample in samples]
+    elif curve_type == "cdf" and cdf_method == "analytic":
+        curves = analytic_cdf_function(samples, function_type="kde", bandwidth=10).y_values
+    elif curve_type == "cdf" and cdf_method == "cumsum":
+        curves = cdf_function(distribution_set(samples, function_type="kde", bandwidth=10)).y_values
+    elif curve_type == "cdf":
+        raise ValueError(f"Unknown CDF method '{cdf_method}'")
+    else:
+        curves = distribution_set(samples, function_type=function_type).y_values
+
+    n_samples = len(samples)
+    n_jobs = resolve_n_jobs(n_jobs)
+    if n_jobs == 1 or n_samples < 2:
+        return kernel(curves)
+
+    if parallel == "thread":
+        executor_type = ThreadPoolExecutor
+    elif parallel == "process":
+        executor_type = ProcessPoolExecutor
+    else:
+        raise ValueError(f"Unknown parallel backend '{parallel}'")
+    if block_size is None:
+        block_size = -(-n_samples // n_jobs)
+    elif block_size < 1:
+        raise ValueError(f"block_size must be a positive integer, got {block_size}.")
+    starts = range(0, n_samples, block_size)
+    blocks = [(i, j) for i in starts for j in starts if j >= i]
+    matrix = np.zeros((n_samples, n_samples))
+    with executor_type(max_workers=n_jobs) as executor:
+        futures = [
+            executor.submit(kernel, curves[i:i + block_size], curves[j:j + block_size])
+            for i, j in blocks
+        ]
+        for (i, j), future in zip(blocks, futures):
+            block = future.result()
+            matrix[i:i + block_size, j:j + block_size] = block
+            matrix[j:j + block_size, i:i + block_size] = block.T
+    return matrix
+
+
+def generate_data_frame(
+        samples,
+        row_labels=None,
+        col_labels=None,
+        metric="similarity",
+        function_type="kde",
+        decimals=2,
+        n_jobs=1,
+        parallel="thread",
+        cdf_method="cumsum",
+):
     if metric == "ks" or metric == "kuiper":
         samples.reverse()
-    sample_kdes = [kde_function(sample, 10).y_values for sample in samples]
-    sample_pdps = [pdp_function(sample).y_values for sample in samples]
-    sample_cdfs = [cdf_function(kde_function(sample, 10)).y_values for sample in samples]
-    num_data_sets = len(samples)
-    matrix = np.zeros((num_data_sets, num_data_sets))
-    if metric == "similarity":
-        for i, sample1 in enumerate(sample_kdes if function_type == "kde" else sample_pdps):
-            for j, sample2 in enumerate(sample_kdes if function_type == "kde" else sample_pdps):
-                similarity_score = metrics.similarity(sample1, sample2)
-                matrix[i, j] = np.round(similarity_score, 2)
-    elif metric == "dis_similarity":
-        for i, sample1 in enumerate(sample_kdes if function_type == "kde" else sample_pdps):
-            for j, sample2 in enumerate(sample_kdes if function_type == "kde" else sample_pdps):
-                dissimilarity_score = metrics.dis_similarity(sample1, sample2)
-                matrix[i, j] = np.round(dissimilarity_score, 2)
-    elif metric == "likeness":
-        for i, sample1 in enumerate(sample_kdes if function_type == "kde" else sample_pdps):
-            for j, sample2 in enumerate(sample_kdes if function_type == "kde" else sample_pdps):
-                likeness_score = metrics.likeness(sample1, sample2)
-                matrix[i, j] = np.round(likeness_score, 2)
-    elif metric == "dis_likeness":
-        for i, sample1 in enumerate(sample_kdes if function_type == "kde" else sample_pdps):
-            for j, sample2 in enumerate(sample_kdes if function_type == "kde" else sample_pdps):
-                likeness_score = metrics.dis_likeness(sample1, sample2)
-                matrix[i, j] = np.round(likeness_score, 2)
-    elif metric == "ks":
-        for i, sample1 in enumerate(sample_cdfs):
-            for j, sample2 in enumerate(sample_cdfs):
-                ks_score = metrics.ks(sample1, sample2)
-                matrix[i, j] = np.round(ks_score, 2)
-    elif metric == "dis_ks":
-        for i, sample1 in enumerate(sample_cdfs):
-            for j, sample2 in enumerate(sample_cdfs):
-                ks_score = metrics.dis_ks(sample1, sample2)
-                matrix[i, j] = np.round(ks_score, 2)
-    elif metric == "kuiper":
-        for i, sample1 in enumerate(sample_cdfs):
-            for j, sample2 in enumerate(sample_cdfs):
-                kuiper_score = metrics.kuiper(sample1, sample2)
-                matrix[i, j] = np.round(kuiper_score, 2)
-    elif metric == "dis_kuiper":
-        for i, sample1 in enumerate(sample_cdfs):
-            for j, sample2 in enumerate(sample_cdfs):
-                kuiper_score = metrics.dis_kuiper(sample1, sample2)
-                matrix[i, j] = np.round(kuiper_score, 2)
-    elif metric == "cross_correlation":
-        for i, sample1 in enumerate(sample_kdes if function_type == "kde" else sample_pdps):
-            for j, sample2 in enumerate(sample_kdes if function_type == "kde" else sample_pdps):
-                cross_correlation_score = metrics.r2(sample1, sample2)
-                matrix[i, j] = np.round(cross_correlation_score, 2)
-    elif metric == "dis_cross_correlation":
-        for i, sample1 in enumerate(sample_kdes if function_type == "kde" else sample_pdps):
-            for j, sample2 in enumerate(sample_kdes if function_type == "kde" else sample_pdps):
-                cross_correlation_score = metrics.dis_r2(sample1, sample2)
-                matrix[i, j] = np.round(cross_correlation_score, 2)
-    else:
-        raise ValueError(f"Unknown metric {metric}")
+    matrix = generate_matrix(
+        samples,
+        metric=metric,
+        function_type=function_type,
+        n_jobs=n_jobs,
+        parallel=parallel,
+        cdf_method=cdf_method,
+    )
+    if decimals is not None:
+        matrix = np.round(matrix, decimals)
     if row_labels is None:
         row_labels = [sample.name for sample in samples]
     if col_labels is None:
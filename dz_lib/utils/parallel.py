@@ -0,0 +1,15 @@
+import os
+
+
+def resolve_n_jobs(n_jobs) -> int:
+    """
+    Number of workers for an n_jobs argument, following the scikit-learn
+    convention: None means 1 and -1 means one per CPU.
+    """
+    if n_jobs is None:
+        return 1
+    if n_jobs == -1:
+        return os.cpu_count() or 1
+    if n_jobs < 1:
+        raise ValueError(f"n_jobs must be a positive integer, None or -1, got {n_jobs}.")
+    return int(n_jobs)
@@ -4,7 +4,7 @@ from dz_lib.univariate import distributions, unmix
 def test():
     samples_array = data.excel_to_array("/home/ryan/Desktop/dz_data/20_50_30.xlsx")
     samples = data.read_1d_samples(samples_array)
-    distros = [distributions.kde_function(sample) for sample in samples]
+    distros = distributions.distribution_set(samples, function_type="kde").to_distributions()
     
     # Use first sample as sink and rest as sources for unmixing
     sink_distro = distros[0]